@@ -1,11 +1,12 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from auditlog.registry import auditlog
 from django.contrib.auth.models import User, Permission
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models, transaction
 from django.db.models import Q, QuerySet
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.http import HttpRequest
 from django.urls import reverse
@@ -146,6 +147,9 @@ class HolderUser(BaseModel):
         return ['view', 'add', 'change', 'delete']
 
 
+CATALOG_USERS_CHOICES_CACHE_TIMEOUT = 5 * 60  # segundos que a lista de usuarios de um catalogo fica em cache
+
+
 class CatalogUser(BaseModel):
     """CatalogUser é uma classe para ligar um usuário à um catálogo"""
     user = models.OneToOneField(verbose_name=_('User'), to=User, on_delete=models.CASCADE,
@@ -169,6 +173,26 @@ class CatalogUser(BaseModel):
         """str method"""
         return f'{self.user.first_name} - {self.catalog}' if self.user.first_name else f'{self.user.username} - {self.catalog}'
 
+    @staticmethod
+    def get_users_choices_cache_key(catalog_id: int) -> str:
+        """Chave de cache da lista de usuarios do catalogo usada por get_users_choices"""
+        return f'artists:catalog_users:{catalog_id}'
+
+    @staticmethod
+    def get_users_choices(catalog_id: int) -> List[Tuple[int, str]]:
+        """
+        Retorna a lista (id, username) dos usuarios do catalogo, usada como choices nos forms dos catalogusers. A lista
+            muda raramente, entao fica em cache e eh invalidada pelos signals de CatalogUser e User
+        Args:
+            catalog_id: id do catalogo
+
+        Returns: lista de tuplas (id, username)
+        """
+        return cache.get_or_set(
+            CatalogUser.get_users_choices_cache_key(catalog_id),
+            lambda: list(User.objects.filter(cataloguser__catalog_id=catalog_id).values_list('id', 'username')),
+            CATALOG_USERS_CHOICES_CACHE_TIMEOUT)
+
 
 POST_SHOW_TO_CHOICES = (
     ('ALL', _('All')),
@@ -420,6 +444,23 @@ def holder_user_post_save(sender, instance: HolderUser, created, *args, **kwargs
         notify_users(notification_code, recipients, author=instance.user)
 
 
+@receiver(post_save, sender=CatalogUser)
+@receiver(post_delete, sender=CatalogUser)
+def catalog_user_clear_users_choices_cache(sender, instance: CatalogUser, *args, **kwargs):
+    """Invalida o cache de usuarios do catalogo quando um CatalogUser eh criado, alterado ou removido"""
+    cache.delete(CatalogUser.get_users_choices_cache_key(instance.catalog_id))
+
+
+@receiver(post_save, sender=User)
+def user_clear_catalog_users_choices_cache(sender, instance: User, created, update_fields=None, *args, **kwargs):
+    """Invalida o cache de usuarios dos catalogos do usuario quando o username pode ter mudado. Usuarios recem
+    criados ainda nao tem CatalogUser, e saves parciais que nao tocam o username (ex.: last_login) sao ignorados."""
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    cache.delete_many([CatalogUser.get_users_choices_cache_key(catalog_id) for catalog_id in
+                       CatalogUser.objects.filter(user_id=instance.id).values_list('catalog_id', flat=True)])
+
+
 auditlog.register(HolderUser)
 auditlog.register(CatalogUser)
 auditlog.register(FAQCategory)
@@ -1,44 +1,135 @@
 from __future__ import absolute_import, unicode_literals
-from celery import shared_task
-from django.db.models import Q
+import zlib
+from typing import List
+
+from celery import shared_task, group
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import IntegerField, Q
+from django.db.models.functions import Cast
 from django.urls import reverse
 from django.utils import timezone
 from notifications.models import Notification
 
 from .models import Task
 from ..clients_and_profiles.models.notifications import SystemNotification, notify_users
+from ..contrib.log_helper import log_error
+
+# Chave do advisory lock do PostgreSQL que serializa as execuções de notify_about_late_tasks entre workers
+LATE_TASKS_NOTIFICATION_LOCK_ID = zlib.crc32(b'tasks.notify_about_late_tasks')
+
+# Janela (em segundos) durante a qual uma tarefa atrasada ja notificada nao eh notificada novamente
+LATE_TASK_NOTIFICATION_DEDUP_WINDOW = 6 * 24 * 60 * 60
+
+# Quantidade de tarefas atrasadas notificadas por cada subtask do group
+LATE_TASKS_NOTIFICATION_CHUNK_SIZE = 500
+
+
+def get_late_task_notified_cache_key(task_id: int) -> str:
+    """Chave de cache que marca uma tarefa atrasada como notificada recentemente"""
+    return f'tasks:late_task_notified:{task_id}'
 
 
 @shared_task
 def notify_about_late_tasks():
-    notification_code = SystemNotification.get_seven_days_late_task_code()
+    """Notifica os usuários sobre as tarefas atrasadas há mais de sete dias.
+
+    Esta task apenas seleciona as tarefas atrasadas e distribui as notificações em chunks entre os workers, através de
+    um group de notify_late_tasks_chunk. Retorna a quantidade de tarefas despachadas.
+
+    Caso outro worker já esteja executando esta task (ex.: beat + retry), a execução atual é ignorada, pois as duas
+    leriam as mesmas tarefas e despachariam as notificações em dobro. Essa checagem usa um advisory lock e por isso só
+    é feita no PostgreSQL.
+    """
+    # O advisory lock so existe no PostgreSQL. Nos demais bancos (ex.: testes e desenvolvimento) nao ha lock
+    if connection.vendor != 'postgresql':
+        return _dispatch_late_tasks_notifications()
+    # O lock eh de sessao, entao eh liberado pelo mesmo cursor (e conexao) que o obteve
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [LATE_TASKS_NOTIFICATION_LOCK_ID])
+        if not cursor.fetchone()[0]:
+            return 0
+        try:
+            return _dispatch_late_tasks_notifications()
+        finally:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [LATE_TASKS_NOTIFICATION_LOCK_ID])
 
+
+def _dispatch_late_tasks_notifications() -> int:
     today = timezone.now().date()
+    seven_days_ago = today - timezone.timedelta(days=7)
 
     # Tarefas atrasadas que ja foram notificadas nao sao notificadas novamente. A query para descobrir se uma tarefa
     #  ja foi notificada verifica todas as notificações com nível warning (usado pelas notificações de tarefa atra-
     #  sada) disparadas nos últimos sete dias, cujo action object nao eh nulo (pois estas notificações sempre passam
-    #  o action object). Pegamos então a lista de ids de tarefas que ja foram notificadas e fazemos o cast para int,
-    #  pois por default, o values_list retorna esses ids como string. precisamos destes valores como int para usar
-    #  no exclude da query de tarefas atrasadas.
-    tasks_already_notified = list(map(int,
-                                      Notification.objects.filter(timestamp__gte=today - timezone.timedelta(days=7),
-                                                                  level='warning',
-                                                                  action_object_object_id__isnull=False).distinct().values_list(
-                                          'action_object_object_id', flat=True)))
+    #  o action object). Os ids das tarefas ja notificadas sao guardados como string no action_object_object_id, por
+    #  isso fazemos o cast para int no proprio banco. A query eh usada como subquery no exclude das tarefas atrasadas,
+    #  evitando trazer os ids para o python e montar um IN que cresce a cada semana. Nao ha distinct pois o IN ja
+    #  ignora ids repetidos, e o distinct so obrigaria o banco a ordenar/agrupar a subquery.
+    tasks_already_notified = Notification.objects.filter(timestamp__gte=seven_days_ago,
+                                                         level='warning',
+                                                         action_object_object_id__isnull=False).annotate(
+        notified_task_id=Cast('action_object_object_id', IntegerField())).values('notified_task_id')
 
     # Pega as tarefas atrasadas deste mes, com a exceção das que ja foram notificadas. Tarefas atrasadas são as que (não
     # estão arquivadas e passaram do prazo) E (cujo status não é terminada OU não tem data de conclusão)
+    #  O predicado de status eh escrito como (status nao finalizado OU sem data de conclusao) E nao cancelada, que eh
+    #  equivalente ao original e pode ser atendido pelo indice parcial tasks_late_idx.
     late_tasks = Task.objects.filter(
-        Q(archived=False, due_date__lt=today - timezone.timedelta(days=7), due_date__month=today.month) & Q(
-            Q(status__in=Task.get_all_statuses_code_except_finished()) | Q(
-                Q(done_date__isnull=True) & ~Q(status__in=[Task.get_canceled_status_code()])))).exclude(
-        id__in=tasks_already_notified)
+        Q(archived=False, due_date__lt=seven_days_ago, due_date__month=today.month),
+        Q(status__in=Task.get_all_statuses_code_except_finished()) | Q(done_date__isnull=True),
+        ~Q(status=Task.get_canceled_status_code())).exclude(id__in=tasks_already_notified)
+    late_task_ids = list(late_tasks.values_list('id', flat=True))
+
+    # Além da checagem pelas notificações gravadas, o cache barra tarefas notificadas dentro da janela de dedup cujas
+    #  notificações ainda não estejam visíveis para esta execução. As marcas são gravadas pelo notify_late_tasks_chunk
+    #  somente depois que as notificações de cada tarefa foram gravadas.
+    already_notified_cache_keys = cache.get_many([get_late_task_notified_cache_key(task_id)
+                                                  for task_id in late_task_ids])
+    late_task_ids = [task_id for task_id in late_task_ids
+                     if get_late_task_notified_cache_key(task_id) not in already_notified_cache_keys]
+    if not late_task_ids:
+        return 0
+
+    group(notify_late_tasks_chunk.s(late_task_ids[i:i + LATE_TASKS_NOTIFICATION_CHUNK_SIZE])
+          for i in range(0, len(late_task_ids), LATE_TASKS_NOTIFICATION_CHUNK_SIZE)).apply_async()
+    return len(late_task_ids)
+
+
+@shared_task
+def notify_late_tasks_chunk(task_ids: List[int]) -> int:
+    """Envia as notificações de tarefa atrasada de um chunk de tarefas despachado por notify_about_late_tasks.
+
+    Retorna a quantidade de notificações enviadas.
+    """
+    notification_code = SystemNotification.get_seven_days_late_task_code()
+    # O only() traz apenas os campos usados no loop: o id para a url, os campos lidos por
+    #  get_relevant_task_notification_recipients (group e assigned_to) e title e due_date para o __str__ usado na
+    #  descrição da notificação.
+    late_tasks = Task.objects.filter(id__in=task_ids).only('id', 'title', 'due_date', 'group', 'assigned_to')
+    # reverse() percorre o resolver de urls a cada chamada. Resolvemos a url uma única vez com um id sentinela (0) e
+    #  apenas substituímos o id de cada tarefa dentro do loop.
+    schedule_url_prefix, _, schedule_url_suffix = reverse('dashboard:tasks.schedule', args=[0]).rpartition('0')
+    # O filtro de quem deseja receber a notificação não depende da tarefa, então é montado uma única vez
+    recipients_query = Q(user_user_profile__profilesystemnotification__notification__code=notification_code)
     notification_amount = 0
-    for task in late_tasks:
-        recipients = task.get_relevant_task_notification_recipients(
-            Q(user_user_profile__profilesystemnotification__notification__code=notification_code))
-        notify_users(notification_code, recipients, action_object=task,
-                     url=reverse('dashboard:tasks.schedule', args=[task.id]))
-        notification_amount += recipients.count()
+    notified_task_ids = []
+    # Todas as notificações (e emails enfileirados) do chunk são gravadas numa única transação, em vez de um commit
+    #  por destinatário de cada tarefa.
+    with transaction.atomic():
+        for task in late_tasks:
+            try:
+                # O savepoint por tarefa garante que a falha de uma tarefa não desfaça as notificações das demais
+                with transaction.atomic():
+                    recipients = task.get_relevant_task_notification_recipients(recipients_query)
+                    notify_users(notification_code, recipients, action_object=task,
+                                 url=f'{schedule_url_prefix}{task.id}{schedule_url_suffix}')
+                    notification_amount += recipients.count()
+                notified_task_ids.append(task.id)
+            except Exception as e:
+                log_error(f'Erro ao notificar a tarefa atrasada {task.id}: {e}')
+    # Só as tarefas cujas notificações foram gravadas são marcadas no cache. Tarefas que falharam, ou de um chunk que
+    #  não chegou a rodar (worker perdido, mensagem descartada), continuam elegíveis na próxima execução.
+    cache.set_many({get_late_task_notified_cache_key(task_id): True for task_id in notified_task_ids},
+                   LATE_TASK_NOTIFICATION_DEDUP_WINDOW)
     return notification_amount
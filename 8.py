@@ -1,12 +1,16 @@
+import hashlib
+import json
 from typing import Tuple, List, Type, Union
 
 from crispy_forms.utils import render_crispy_form
 from django.contrib import messages
-from django.contrib.auth.decorators import login_required, user_passes_test, permission_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db.models import Q
-from django.http import HttpResponseNotFound, JsonResponse, HttpResponseBadRequest, HttpRequest
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Case, When, Value, CharField
+from django.http import HttpResponse, HttpResponseNotFound, JsonResponse, HttpResponseBadRequest, HttpRequest
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.shortcuts import render, redirect
@@ -27,13 +31,54 @@ from music_system.apps.tasks.forms import TaskFrontForm, TaskItemFrontInline, Pr
     TaskItemNoGroupFrontInline, ProjectModelForm, TaskModelFrontForm, TaskModelItemFrontInline, \
     TaskModelItemNoGroupFrontInline, TaskModelFrontNoGroupForm
 from music_system.apps.tasks.models import Task
-from music_system.apps.tasks.models.base import TaskItem, TaskComment, Project, TaskModel, ProjectModel
+from music_system.apps.tasks.models.base import TaskItem, TaskComment, Project, TaskModel, ProjectModel, TaskGroup, \
+    get_select2_cache_version_key
+from music_system.apps.clients_and_profiles.models.base import Profile
+from music_system.apps.artists.models import CatalogUser
 
 from music_system.apps.contrib.api_helpers import get_default_response_dict, get_generic_error_status, \
     get_success_status, get_api_response_dict
 
 from notifications.signals import notify
 
+TASKS_LIST_BUCKETS = ['late', 'today', 'week', 'upcoming', 'dateless']  # grupos da lista de tarefas, na ordem exibida
+
+
+# Campos de multipla escolha dos filtros da lista/calendario de tarefas, no formato (campo, parametro do GET, parametro
+#  do GET com [] (enviado pelo select2), lookup do filtro). Os nomes sao montados uma unica vez, e nao a cada request
+TASKS_MULTIPLE_SELECT_FILTERS = tuple((field, f'filter_{field}', f'filter_{field}[]', f'{field}__in')
+                                      for field in ['project', 'status', 'priority', 'group'])
+
+# o DataTables nao precisa de json indentado/espacado: os separadores compactos reduzem o tamanho das responses
+DATATABLES_JSON_DUMPS_PARAMS = {'separators': (',', ':')}
+# corpo da response do DataTables quando a pagina nao tem itens (draw ja serializado em json, recordsTotal e
+#  recordsFiltered)
+DATATABLES_EMPTY_RESPONSE_CONTENT = '{"data":[],"draw":%s,"recordsTotal":%d,"recordsFiltered":%d}'
+
+
+def staff_permission_required(perm: str):
+    """Decorator que exige um usuario staff com a permissao passada. Equivale a empilhar permission_required,
+    login_required e user_passes_test(is_staff), mas numa unica checagem: usuarios anonimos nao sao staff nem tem
+    permissoes, entao tambem sao redirecionados para o login."""
+    return user_passes_test(lambda user: user.is_staff and user.has_perm(perm))
+
+
+def get_request_user_profile_and_is_catalog(request) -> Tuple[Profile, bool]:
+    """Retorna o perfil do usuario da request e se ele eh cataloguser. Como as views de tarefas consultam essas
+    informacoes varias vezes por request, o resultado eh guardado na propria request e calculado apenas uma vez."""
+    if not hasattr(request, '_tasks_user_profile_and_is_catalog'):
+        request_user_profile = get_user_profile_from_request(request)
+        request._tasks_user_profile_and_is_catalog = (request_user_profile, request_user_profile.user_is_catalog())
+    return request._tasks_user_profile_and_is_catalog
+
+
+def get_request_user_task_group_ids(request) -> List[int]:
+    """Retorna os ids dos grupos de tarefa do usuario da request, guardados na propria request como em
+    get_request_user_profile_and_is_catalog."""
+    if not hasattr(request, '_tasks_user_task_group_ids'):
+        request._tasks_user_task_group_ids = list(request.user.task_group_users.values_list('id', flat=True))
+    return request._tasks_user_task_group_ids
+
 
 def get_query_params_for_tasks_lists(request, request_has_dates=False) -> Q:
     if request_has_dates:
@@ -44,55 +89,54 @@ def get_query_params_for_tasks_lists(request, request_has_dates=False) -> Q:
         query_params = Q()
 
     # filtra por catalogo caso o usuario seja cataloguser
-    request_user_profile = get_user_profile_from_request(request)
-    if request_user_profile.user_is_catalog():
+    request_user_profile, request_user_is_catalog = get_request_user_profile_and_is_catalog(request)
+    if request_user_is_catalog:
         query_params &= Q(
             catalog=request_user_profile.get_user_catalog())  # todo consistencia de catalogo. eh pra colocar se a tarefa modelo ou se o projeto eh do msm catalogo tbm?
 
-    multiple_select_fields = [
-        'project',
-        'status',
-        'priority',
-    ]
-    # se nao for cataloguser, group tem que ir no multiple_select_fields.
-    if not request.user.user_user_profile.user_is_catalog():
-        multiple_select_fields.append('group')
-    filter_title = request.GET.get('filter_title', None)
+    query_get = request.GET
+    get_list = query_get.getlist
+    filter_title = query_get.get('filter_title', None)
     if filter_title:
         filter_title_agg = Q(title__icontains=filter_title)
-        try:
+        # se a busca for numerica, tambem procura pelo id da tarefa
+        if filter_title.isdecimal():
             filter_title_agg |= Q(id=int(filter_title))
-            query_params &= Q(filter_title_agg)
-        except ValueError:
-            query_params &= filter_title_agg
+        query_params &= filter_title_agg
 
-    include_archived = request.GET.get('filter_archived')
+    include_archived = query_get.get('filter_archived')
     if not include_archived or include_archived != "on":
         query_params &= Q(archived=False)
 
-    filter_assigned_to = request.GET.getlist('filter_assigned_to', [])
-    if len(filter_assigned_to) > 0:
+    filter_assigned_to = get_list('filter_assigned_to', [])
+    if filter_assigned_to:
+        # Os filtros pelos itens e pelos usuarios do grupo sao feitos por subqueries (IN), e nao por JOIN, para que as
+        #  tarefas nao se multipliquem no resultado (o que obrigaria um distinct) nem restrinjam os contadores de itens
+        #  anotados por Task.annotate_sub_items_counts
+        items_query = Q(assigned_to__in=filter_assigned_to)
         filter_assigned_to_query = Q(assigned_to__in=filter_assigned_to)
-        filter_assigned_to_query |= Q(taskitem_task__assigned_to__in=filter_assigned_to)
-        if request.GET.get('filter_assigned_to_include_groups', 'off') == 'on':
-            filter_assigned_to_query |= Q(group__users__in=filter_assigned_to)
-            filter_assigned_to_query |= Q(taskitem_task__group__users__in=filter_assigned_to)
-        query_params &= Q(filter_assigned_to_query)
-
-    for multiple_select_field in multiple_select_fields:
-        form_field = request.GET.getlist("filter_{}".format(multiple_select_field), []) if request.GET.getlist(
-            "filter_{}".format(multiple_select_field), None) else request.GET.getlist(
-            "filter_{}[]".format(multiple_select_field), [])
-        if len(form_field) > 0:
-            query_params &= Q(**{"{}__in".format(multiple_select_field): form_field})
+        if query_get.get('filter_assigned_to_include_groups', 'off') == 'on':
+            items_query |= Q(group__users__in=filter_assigned_to)
+            filter_assigned_to_query |= Q(group__in=TaskGroup.objects.filter(users__in=filter_assigned_to).values('id'))
+        filter_assigned_to_query |= Q(id__in=TaskItem.objects.filter(items_query).values('task_id'))
+        query_params &= filter_assigned_to_query
+
+    for field, param, list_param, lookup in TASKS_MULTIPLE_SELECT_FILTERS:
+        # se for cataloguser, o filtro de group nao eh aplicado
+        if field == 'group' and request_user_is_catalog:
+            continue
+        # getlist retorna lista vazia quando o parametro nao existe, entao o 'or' cai no formato com []
+        form_field = get_list(param) or get_list(list_param)
+        if form_field:
+            query_params &= Q(**{lookup: form_field})
 
     return query_params
 
 
 def get_private_tasks_query(user_id: int, is_superuser: bool = False):
     """
-    Método usado para filtrar as tarefas privadas do sistema. Caso o usuário seja superusuário, a queryset volta vazia,
-    pois o superuser deve poder ver todas as tarefas do sistema. Caso contrário, a queryset volta um filtro das tarefas
+    Método usado para filtrar as tarefas privadas do sistema. Caso o usuário seja superusuário, volta None (nenhum
+    filtro), pois o superuser deve poder ver todas as tarefas do sistema. Caso contrário, volta um filtro das tarefas
     privadas cujo usuário em questão não é o atribuído e nem pertence ao grupo, para que estas tarefas não aparecam para
     este usuário.
     Args:
@@ -100,13 +144,20 @@ def get_private_tasks_query(user_id: int, is_superuser: bool = False):
         is_superuser: boolean que indica se o usuário é superuser (usado para evitar uma busca no bd só para fazer esta
             verificação)
 
-    Returns: queryset de filtragem
+    Returns: Q de filtragem, ou None caso não haja o que filtrar
     """
     if is_superuser:
-        query = Q()
-    else:
-        query = Q(is_private=True) & Q(~Q(assigned_to__id=user_id) & ~Q(group__users__id__in=[user_id]))
-    return query
+        return None
+    return Q(is_private=True) & Q(~Q(assigned_to__id=user_id) & ~Q(group__users__id__in=[user_id]))
+
+
+def exclude_private_tasks(queryset, user: User):
+    """Remove da queryset as tarefas privadas que o usuário não pode ver. Para superusuários a queryset volta intacta,
+    sem passar por um exclude vazio."""
+    private_tasks_query = get_private_tasks_query(user.id, user.is_superuser)
+    if private_tasks_query is not None:
+        queryset = queryset.exclude(private_tasks_query)
+    return queryset
 
 
 @require_GET
@@ -119,36 +170,38 @@ def api_get_tasks_calendar(request):
 
     try:
         query_params = get_query_params_for_tasks_lists(request, True)
-        tasks = Task.objects.prefetch_related(
-            'assigned_to', 'group', 'assigned_to__groups', 'taskcomment_set', 'taskcomment_set__user',
-            'project').filter(query_params).distinct().exclude(get_private_tasks_query(request.user.id))
-        for task in tasks:
-            task_dict_response = {}
-            task_dict = task.get_data_for_api(True, True, request.user, True, False, False)
-            task_dict_response['start'] = task_dict['due_date']
-            task_dict_response['end'] = task_dict['due_date']
-            task_dict_response['id'] = task_dict['id']
-            task_dict_response['allDay'] = ""
-            if task.project is not None:
-                task_dict_response['project__title'] = task_dict['project__title']
-            else:
-                task_dict_response['project__title'] = 'N/A'
-            task_dict_response['title'] = task_dict['title']
-            task_dict_response['description'] = task_dict['description']
-            task_dict_response['checklist_counter'] = "{}: {}/{}".format(_('Checklists'), task_dict['sub_items__todo'],
-                                                                         task_dict['sub_items__total'])
-            task_dict_response['priority_display'] = "{}: {}".format(_('Priority'), task_dict['priority_display'])
-            task_dict_response['is_done'] = task_dict['status'] == Task.get_done_status_code()
-            task_dict_response['status_display'] = "{}: {}".format(_('Status'), task_dict['status_display'])
-            task_dict_response['assignment_type'] = task_dict['assignment_type']
-            task_dict_response['assigned_to__name'] = "{}: {}".format(_('Assigned To'), task_dict['assigned_to__name'])
-            # somente manda o group name na response se o usuario nao for catalog
-            if not request.user.user_user_profile.user_is_catalog():
-                task_dict_response['group__name'] = "{} {}".format(_('Group'), task_dict['group__name'])
-            task_dict_response['front_class'] = Task.get_priority_front_color(task_dict['priority'])
-            response.append(task_dict_response)
-
-            # response['status'] = get_success_status()
+        # values() traz apenas as colunas usadas na response (assigned_to, group e project vem no mesmo JOIN), sem
+        #  instanciar as tarefas
+        tasks = exclude_private_tasks(Task.annotate_sub_items_counts(Task.objects.filter(query_params), request.user),
+                                      request.user).values(*Task.get_list_values_fields())
+        user_task_group_ids = get_request_user_task_group_ids(request)
+        done_status_code = Task.get_done_status_code()
+        # somente manda o group name na response se o usuario nao for catalog
+        include_group_name = not get_request_user_profile_and_is_catalog(request)[1]
+        # os textos traduzidos sao resolvidos uma unica vez, e nao a cada tarefa
+        checklists_label = str(_('Checklists'))
+        priority_label = str(_('Priority'))
+        status_label = str(_('Status'))
+        assigned_to_label = str(_('Assigned To'))
+        group_label = str(_('Group'))
+        response = [{
+            'start': task_dict['due_date'],
+            'end': task_dict['due_date'],
+            'id': task_dict['id'],
+            'allDay': "",
+            'project__title': task_dict['project__title'],
+            'title': task_dict['title'],
+            'description': task_dict['description'],
+            'checklist_counter': f"{checklists_label}: {task_dict['sub_items__todo']}/{task_dict['sub_items__total']}",
+            'priority_display': f"{priority_label}: {task_dict['priority_display']}",
+            'is_done': task_dict['status'] == done_status_code,
+            'status_display': f"{status_label}: {task_dict['status_display']}",
+            'assignment_type': task_dict['assignment_type'],
+            'assigned_to__name': f"{assigned_to_label}: {task_dict['assigned_to__name']}",
+            **({'group__name': f"{group_label} {task_dict['group__name']}"} if include_group_name else {}),
+            'front_class': Task.get_priority_front_color(task_dict['priority']),
+        } for task_dict in (Task.get_list_data_from_values(task_values, request.user.id, user_task_group_ids)
+                            for task_values in tasks)]
 
     except ObjectDoesNotExist:
         return HttpResponseNotFound()
@@ -167,41 +220,37 @@ def api_get_tasks_list(request):
     http_status = 200
     query_params = get_query_params_for_tasks_lists(request, False)
     try:
-        today = timezone.datetime.now().date()
-
-        tasks_late = get_tasks_for_list(
-            Task.objects.filter(Q(query_params, due_date__lt=today) & Q(
-                Q(status__in=Task.get_all_statuses_code_except_finished()) | Q(done_date__isnull=True))).order_by(
-                'due_date').distinct().exclude(
-                get_private_tasks_query(request.user.id)), request)
-        response['data']['items'].append({'name': 'late', 'items': tasks_late})
-
-        tasks_today = get_tasks_for_list(
-            Task.objects.filter(query_params, due_date=today).order_by('due_date').distinct().exclude(
-                get_private_tasks_query(request.user.id)), request)
-        response['data']['items'].append({'name': 'today', 'items': tasks_today})
-
-        tasks_week = get_tasks_for_list(Task.objects.filter(query_params, due_date__range=(
-            today + timezone.timedelta(days=1), today + timezone.timedelta(days=7))).order_by(
-            'due_date').distinct().exclude(get_private_tasks_query(request.user.id)), request)
-        response['data']['items'].append({'name': 'week', 'items': tasks_week})
-
-        tasks_upcoming = get_tasks_for_list(
-            Task.objects.filter(query_params, due_date__gt=today + timezone.timedelta(days=7)).order_by(
-                'due_date').distinct().exclude(get_private_tasks_query(request.user.id)), request)
-        response['data']['items'].append({'name': 'upcoming', 'items': tasks_upcoming})
-
-        tasks_dateless = get_tasks_for_list(
-            Task.objects.filter(query_params, due_date__isnull=True).order_by('due_date').distinct().exclude(
-                get_private_tasks_query(request.user.id)), request)
-        response['data']['items'].append({'name': 'dateless', 'items': tasks_dateless})
+        today = timezone.localdate()
+        tomorrow = today + timezone.timedelta(days=1)
+        a_week_from_today = today + timezone.timedelta(days=7)
+        sixty_days_ago = today - timezone.timedelta(days=60)
+
+        # Uma unica query traz as tarefas de todos os grupos da lista, cada uma anotada com o nome do seu grupo. As
+        #  tarefas passadas ja finalizadas nao pertencem a nenhum grupo e ficam de fora.
+        tasks = exclude_private_tasks(Task.annotate_sub_items_counts(Task.objects.filter(query_params),
+                                                                     request.user).annotate(list_bucket=Case(
+            When(Q(due_date__lt=today) & Q(
+                Q(status__in=Task.get_all_statuses_code_except_finished()) | Q(done_date__isnull=True)),
+                 then=Value('late')),
+            When(due_date=today, then=Value('today')),
+            When(due_date__range=(tomorrow, a_week_from_today), then=Value('week')),
+            When(due_date__gt=a_week_from_today, then=Value('upcoming')),
+            When(due_date__isnull=True, then=Value('dateless')),
+            default=Value(''), output_field=CharField())).exclude(list_bucket='').order_by(
+            'due_date'), request.user).values(*Task.get_list_values_fields(), 'list_bucket')
+        tasks_by_bucket = {bucket: [] for bucket in TASKS_LIST_BUCKETS}
+        for task_values in tasks:
+            tasks_by_bucket[task_values['list_bucket']].append(task_values)
+        for bucket in TASKS_LIST_BUCKETS:
+            response['data']['items'].append({'name': bucket, 'items': get_tasks_for_list(tasks_by_bucket[bucket],
+                                                                                          request)})
 
         tasks_done = []
         if request.GET.get('filter_status') == 'DON':
-            tasks_done = get_tasks_for_list(
-                Task.objects.filter(query_params, due_date__lt=today,
-                                    due_date__gte=today - timezone.timedelta(days=60)).order_by(
-                    '-due_date').distinct().exclude(get_private_tasks_query(request.user.id)), request)
+            tasks_done = get_tasks_for_list(exclude_private_tasks(Task.annotate_sub_items_counts(
+                Task.objects.filter(query_params, due_date__lt=today, due_date__gte=sixty_days_ago),
+                request.user).order_by('-due_date'), request.user).values(*Task.get_list_values_fields()),
+                request)
         response['data']['items'].append({'name': 'done', 'items': tasks_done})
 
     except ObjectDoesNotExist as e:
@@ -213,25 +262,37 @@ def api_get_tasks_list(request):
 
 
 def get_tasks_for_list(tasks, request) -> list:
-    task_list = []
-    for task in tasks:
-        task_dict_response = {}
-        task_dict = task.get_data_for_api(True, True, request.user, True, False)
-        task_dict_response['id'] = task_dict['id']
-        if task.project is not None:
-            task_dict_response['project__title'] = task_dict['project__title']
-        else:
-            task_dict_response['project__title'] = 'N/A'
-        task_dict_response['title'] = task_dict['title'] if task_dict['assignment_type'] == '' else "{} - {}".format(
-            task_dict['assignment_type'], task_dict['title'])
-        task_dict_response['due_date'] = task_dict['due_date'] if task_dict['due_date'] is not None else _('N/A')
-        task_dict_response['checklist_counter'] = "{}: {}/{}".format(_('Checklists'), task_dict['sub_items__todo'],
-                                                                     task_dict['sub_items__total'])
-        task_dict_response['is_done'] = task_dict['status'] == Task.get_done_status_code()
-        task_dict_response['status_display'] = task_dict['status_display']
-        task_dict_response['front_class'] = Task.get_priority_front_color(task.priority)
-        task_list.append(task_dict_response)
-    return task_list
+    """Monta os itens da lista de tarefas a partir de linhas de .values(*Task.get_list_values_fields())"""
+    user_task_group_ids = get_request_user_task_group_ids(request)
+    done_status_code = Task.get_done_status_code()
+    # os textos traduzidos sao resolvidos uma unica vez, e nao a cada tarefa
+    not_available_label = str(_('N/A'))
+    checklists_label = str(_('Checklists'))
+    return [{
+        'id': task_dict['id'],
+        'project__title': task_dict['project__title'],
+        'title': (task_dict['title'] if task_dict['assignment_type'] == '' else
+                  f"{task_dict['assignment_type']} - {task_dict['title']}"),
+        'due_date': task_dict['due_date'] if task_dict['due_date'] is not None else not_available_label,
+        'checklist_counter': f"{checklists_label}: {task_dict['sub_items__todo']}/{task_dict['sub_items__total']}",
+        'is_done': task_dict['status'] == done_status_code,
+        'status_display': task_dict['status_display'],
+        'front_class': Task.get_priority_front_color(task_dict['priority']),
+    } for task_dict in (Task.get_list_data_from_values(task_values, request.user.id, user_task_group_ids)
+                        for task_values in tasks)]
+
+
+def set_cataloguser_assigned_to_choices(form, formset, catalog_id: int):
+    """Restringe os choices de assigned_to do form da tarefa e dos forms de itens aos usuarios do catalogo, que eh a
+    lista de usuarios que o cataloguser pode ver"""
+    assigned_to_choices = CatalogUser.get_users_choices(catalog_id)
+    form.fields['assigned_to'].choices = assigned_to_choices
+    # como os catalogusers nao definem grupo, assigned_to se torna obrigatorio. por isso a opcao default (que possibi-
+    #  lita escolha nula) so entra nos choices dos itens, de forma a obrigar o cataloguser a definir um assigned to na
+    #  tarefa, mas possibilitando que ele nao crie taskitems. A lista eh montada uma vez e compartilhada pelos itens
+    item_assigned_to_choices = [('', '------------'), *assigned_to_choices]
+    for formset_form in formset.forms:
+        formset_form.fields['assigned_to'].choices = item_assigned_to_choices
 
 
 @require_GET
@@ -240,29 +301,20 @@ def get_tasks_for_list(tasks, request) -> list:
 def api_get_task_details(request, task_id: int):
     """Get Product details for api.
     """
-    # define a opcao default pra possibilitar escolha nula
-    default_option = ('', '------------')
     response = get_default_response_dict()
-    request_user_profile = get_user_profile_from_request(request)
+    request_user_profile, request_user_is_catalog = get_request_user_profile_and_is_catalog(request)
     try:
-        task = Task.objects.get(id=task_id)
-        if not request_user_profile.user_is_catalog():
+        # projeto, grupo e responsavel sao lidos pelo get_data_for_api, entao vem no mesmo JOIN da tarefa
+        task = Task.objects.select_related('project', 'group', 'assigned_to').get(id=task_id)
+        if not request_user_is_catalog:
             form = TaskFrontForm(instance=task)
             formset = TaskItemFrontInline(instance=task)
         else:
             form = TaskFrontNoGroupForm(instance=task)
             formset = TaskItemNoGroupFrontInline(instance=task)
-            # define a lista de usuarios que o cataloguser pode ver
-            assigned_to_choices = list(User.objects.filter(
-                cataloguser__catalog=request_user_profile.get_user_catalog()).values_list('id', 'username'))
-            form.fields['assigned_to'].choices = assigned_to_choices
-            # como os catalogusers nao definem grupo, assigned_to se torna obrigatorio. por isso so adicionamos a opcao
-            #  default depois que colocamos as opções de usuario no assigned to, de forma a obrigar o cataloguser a defi
-            #  nir um assigned to na tarefa, mas possibilitando que ele nao crie taskitems
-            assigned_to_choices.insert(0, default_option)
-            for formset_form in formset.forms:
-                formset_form.fields['assigned_to'].choices = assigned_to_choices
-        response['data']['items'] = [task.get_data_for_api(True, True, request.user, True, True, True)]
+            set_cataloguser_assigned_to_choices(form, formset, request_user_profile.get_user_catalog().id)
+        response['data']['items'] = [task.get_data_for_api(
+            True, True, request.user, True, True, True, user_to_check_groups=get_request_user_task_group_ids(request))]
         response['data']['items'][0]['front_class'] = Task.get_priority_front_color(task.priority)
         response['data']['items'][0]['front_form'] = render_crispy_form(form)
         response['data']['items'][0]['front_form_item'] = render_dynamic_crispy_formset(formset, _('Task Items'))
@@ -322,9 +374,12 @@ def helper_api_task_status(request, task_id, archive: bool = False, mark_as_done
         if request.method != "POST":
             return HttpResponseBadRequest()
         task = Task.objects.get(id=task_id)
+        # mark_status_as_done e mark_status_as_canceled_or_onhold ja salvam somente os campos de status, entao a
+        #  tarefa so eh salva aqui ao arquivar ou marcar como nova
         if archive:
             task.archived = True
             task.status = Task.get_done_status_code()
+            task.save()
         else:
             if mark_as_new:
                 new_check = task.mark_status_as_new()
@@ -332,6 +387,7 @@ def helper_api_task_status(request, task_id, archive: bool = False, mark_as_done
                     response['status'] = get_generic_error_status()
                     response['data']['message'] = new_check
                     return JsonResponse(response)
+                task.save()
             elif mark_as_done:
                 done_check = task.mark_status_as_done()
                 if done_check is not None:
@@ -340,7 +396,6 @@ def helper_api_task_status(request, task_id, archive: bool = False, mark_as_done
                     return JsonResponse(response)
             else:
                 task.mark_status_as_canceled_or_onhold(mark_as_canceled)
-        task.save()
     except ObjectDoesNotExist:
         return HttpResponseNotFound()
     except KeyError:
@@ -362,8 +417,11 @@ def api_task_comment(request, task_id: int):
         if comment_text is None:
             raise KeyError
         new_task_comment = TaskComment(task_id=task_id, comment=comment_text, user_id=request.user.id)
-        new_task_comment.save()
-    except ObjectDoesNotExist:
+        # A tarefa nao eh buscada antes. Se ela nao existir, o post_save do comentario levanta DoesNotExist e o
+        #  savepoint desfaz o INSERT (fora do ATOMIC_REQUESTS, a FK adiada tambem eh rejeitada no fim do bloco)
+        with transaction.atomic():
+            new_task_comment.save()
+    except (ObjectDoesNotExist, IntegrityError):
         return HttpResponseNotFound()
     except KeyError:
         return HttpResponseBadRequest()
@@ -401,26 +459,16 @@ def api_task_item_toggle_status(request, task_id: int):
 def api_new_task(request):
     """View to create the new task and its checklists (through formsets)
     """
-    # define a opcao default pra possibilitar escolha nula
-    default_option = ('', '------------')
-    request_user_profile = get_user_profile_from_request(request)
+    request_user_profile, request_user_is_catalog = get_request_user_profile_and_is_catalog(request)
     if request.method != "POST":
-        if not request_user_profile.user_is_catalog():
+        if not request_user_is_catalog:
             form = TaskFrontForm()
             formset = TaskItemFrontInline()
         else:
-            form = TaskFrontNoGroupForm(initial={'catalog': request_user_profile.get_user_catalog()})
-            # define a lista de usuarios que o cataloguser pode ver
-            assigned_to_choices = list(User.objects.filter(
-                cataloguser__catalog=request_user_profile.get_user_catalog()).values_list('id', 'username'))
-            form.fields['assigned_to'].choices = assigned_to_choices
-            # como os catalogusers nao definem grupo, assigned_to se torna obrigatorio. por isso so adicionamos a opcao
-            #  default depois que colocamos as opções de usuario no assigned to, de forma a obrigar o cataloguser a defi
-            #  nir um assigned to na tarefa, mas possibilitando que ele nao crie taskitems
-            assigned_to_choices.insert(0, default_option)
+            user_catalog = request_user_profile.get_user_catalog()
+            form = TaskFrontNoGroupForm(initial={'catalog': user_catalog})
             formset = TaskItemNoGroupFrontInline()
-            for formset_form in formset.forms:
-                formset_form.fields['assigned_to'].choices = assigned_to_choices
+            set_cataloguser_assigned_to_choices(form, formset, user_catalog.id)
         response = helper_populate_task_response_with_empty_front_form(form, formset)
 
     else:
@@ -485,11 +533,13 @@ def new_or_edit_task_model(request, task_id=None):
 def api_edit_task(request, task_id):
     """View to edit a task and its checklists (through formsets)
     """
-    request_user_profile = get_user_profile_from_request(request)
+    request_user_profile, request_user_is_catalog = get_request_user_profile_and_is_catalog(request)
     try:
         task = Task.objects.get(id=task_id)
-        response = process_task_form(task, request)
-        if not request_user_profile.user_is_catalog():
+        # o front_form da response eh sempre o form em branco montado abaixo, entao process_task_form nao precisa
+        #  renderizar o form submetido quando ele for invalido
+        response = process_task_form(task, request, include_front_form=False)
+        if not request_user_is_catalog:
             form = TaskFrontForm(initial={'assigned_to': request.user}, new_item=True)
         else:
             form = TaskFrontNoGroupForm(
@@ -498,9 +548,11 @@ def api_edit_task(request, task_id):
         response['data']['items'][0]['front_form'] = render_crispy_form(form)
         # Envia a notificação para o usuário atribuído à tarefa sobre a edição da mesma
         notification_code = SystemNotification.get_task_edited_code()
+        # o atribuido eh no maximo um usuario. O if avalia a queryset (uma unica query, sem um exists() antes) e guarda
+        #  o resultado no cache da propria queryset, que eh reaproveitado pelo notify_users
         recipient = User.objects.filter(id=task.assigned_to_id,
                                         user_user_profile__profilesystemnotification__notification__code=notification_code)
-        if recipient.exists():
+        if recipient:
             notify_users(notification_code, recipient, author=request.user, action_object=task,
                          url=reverse('dashboard:tasks.schedule'))
     except ObjectDoesNotExist:
@@ -510,14 +562,15 @@ def api_edit_task(request, task_id):
     return JsonResponse(response)
 
 
-def process_task_form(task: Union[Task, TaskModel], request: HttpRequest) -> dict:
+def process_task_form(task: Union[Task, TaskModel], request: HttpRequest, include_front_form: bool = True) -> dict:
     """Function to parse form and create/edit the task passed.
 
-    The logic is the same, the only difference is how the task gets instantiated
+    The logic is the same, the only difference is how the task gets instantiated. include_front_form=False skips
+    rendering the submitted form on errors, for callers that replace front_form afterwards.
     """
     form_data = {'data': request.POST, 'instance': task, 'new_item': False}
     formset_data = {'data': request.POST, 'instance': task}
-    if not request.user.user_user_profile.user_is_catalog():
+    if not get_request_user_profile_and_is_catalog(request)[1]:
         form = TaskFrontForm(**form_data) if isinstance(task, Task) else TaskModelFrontForm(**form_data)
         formset = TaskItemFrontInline(**formset_data) if isinstance(task, Task) else TaskModelItemFrontInline(
             **formset_data)
@@ -533,33 +586,33 @@ def process_task_form(task: Union[Task, TaskModel], request: HttpRequest) -> dic
         form.save()
         formset.save()
         response = get_default_response_dict()
-        response['data']['items'] = [task.get_data_for_api(True, True, request.user, True, True)]
+        response['data']['items'] = [task.get_data_for_api(
+            True, True, request.user, True, True, user_to_check_groups=get_request_user_task_group_ids(request))]
         response['status'] = get_success_status()
         response['data']['message'] = ''
     else:
-        response = helper_populate_task_response_with_empty_front_form(form, formset)
+        response = helper_populate_task_response_with_empty_front_form(form, formset, include_front_form)
         response['status'] = get_generic_error_status()
         response['data']['message'] = _('Form not valid.')
 
     return response
 
 
-def helper_populate_task_response_with_empty_front_form(form, formset):
+def helper_populate_task_response_with_empty_front_form(form, formset, include_front_form: bool = True):
     """Helper que retorna uma padrão, comn um formulário front de task e seu formset
 
     The logic is the same, the only difference is how the task gets instantiated
     """
     response = get_default_response_dict()
     response['data']['items'] = [{}]
-    response['data']['items'][0]['front_form'] = render_crispy_form(form)
+    if include_front_form:
+        response['data']['items'][0]['front_form'] = render_crispy_form(form)
     response['data']['items'][0]['front_form_item'] = render_dynamic_crispy_formset(formset, _('Task Items'))
     response['data']['items'][0]['front_form_item_prefix'] = formset.prefix
     return response
 
 
-@permission_required('tasks.add_project')
-@login_required
-@user_passes_test(lambda user: user.is_staff)
+@staff_permission_required('tasks.add_project')
 def new_project(request):
     """View to create the new project
     """
@@ -577,15 +630,14 @@ def new_project(request):
     return render(request, 'tasks/new_or_edit_project.html', context=context)
 
 
-@permission_required('tasks.change_project')
-@login_required
-@user_passes_test(lambda user: user.is_staff)
+@staff_permission_required('tasks.change_project')
 def edit_project(request, project_id):
     """View to edit a project
     """
     # todo check client
     context = dict()
-    project = Project.objects.get(id=project_id)
+    # as contagens de tarefas usadas por tasks_progress vem anotadas na mesma query do projeto
+    project = Project.with_task_counts().get(id=project_id)
     if request.method == 'POST':
         form = ProjectForm(instance=project, data=request.POST)
         if form.is_valid():
@@ -606,9 +658,7 @@ def edit_project(request, project_id):
         return render(request, 'tasks/new_or_edit_project.html', context=context)
 
 
-@permission_required('tasks.add_projectmodel')
-@login_required
-@user_passes_test(lambda user: user.is_staff)
+@staff_permission_required('tasks.add_projectmodel')
 def new_project_model(request):
     """ Criar novo projeto modelo
     """
@@ -626,9 +676,7 @@ def new_project_model(request):
     return render(request, 'tasks/new_or_edit_project_model.html', context=context)
 
 
-@permission_required('tasks.change_project')
-@login_required
-@user_passes_test(lambda user: user.is_staff)
+@staff_permission_required('tasks.change_project')
 def edit_project_model(request, project_id):
     """View to edit a project model
     """
@@ -653,9 +701,7 @@ def edit_project_model(request, project_id):
 
 
 @require_POST
-@login_required
-@permission_required('tasks.can_postpone_project')
-@user_passes_test(lambda user: user.is_staff)
+@staff_permission_required('tasks.can_postpone_project')
 def postpone_project(request, project_id):
     """Adia um project por um número x de dias.
     """
@@ -673,69 +719,47 @@ def postpone_project(request, project_id):
     return JsonResponse(response)
 
 
-@permission_required('tasks.view_project')
-@login_required
-@user_passes_test(lambda user: user.is_staff)
+@staff_permission_required('tasks.view_project')
 def api_list_projects(request):
     """
     Gerencia a busca dinamica do DataTables
     """
-    projects = Project.query_products_by_args(
-        request)  # retorna um dict com os produtos filtrados e outras info importantes pro datatables
-    serialized_projects = []
-    for project in projects['items']:  # projects[items] tem cada objeto projeto
-        project_dict = project.get_data_for_api()
-        project_dict['DT_RowId'] = project.id
-        serialized_projects.append(project_dict)
-    result = dict()
-    result['data'] = serialized_projects
-    result['draw'] = projects['draw']
-    result['recordsTotal'] = projects['count']
-    result['recordsFiltered'] = projects['count']
-    return JsonResponse(result, status=200)
-
-
-@permission_required('tasks.view_projectmodel')
-@login_required
-@user_passes_test(lambda user: user.is_staff)
+    # retorna um dict com os produtos filtrados e outras info importantes pro datatables
+    return helper_datatables_response(Project.query_products_by_args(request))
+
+
+@staff_permission_required('tasks.view_projectmodel')
 def api_list_project_models(request):
     """
     Gerencia a busca dinamica do DataTables
     """
-    projects = ProjectModel.query_products_by_args(
-        request)  # retorna um dict com os produtos filtrados e outras info importantes pro datatables
-    serialized_projects = []
-    for project in projects['items']:  # projects[items] tem cada objeto projeto
-        project_dict = project.get_data_for_api()
-        project_dict['DT_RowId'] = project.id
-        serialized_projects.append(project_dict)
-    result = dict()
-    result['data'] = serialized_projects
-    result['draw'] = projects['draw']
-    result['recordsTotal'] = projects['count']
-    result['recordsFiltered'] = projects['count']
-    return JsonResponse(result, status=200)
-
-
-@permission_required('tasks.view_taskmodel')
-@login_required
-@user_passes_test(lambda user: user.is_staff)
+    return helper_datatables_response(ProjectModel.query_products_by_args(request))
+
+
+@staff_permission_required('tasks.view_taskmodel')
 def api_list_task_models(request):
     """
     Gerencia a busca dinamica do DataTables
     """
-    tasks = TaskModel.query_products_by_args(request)
-    serialized_tasks = []
-    for task in tasks['items']:  # tasks[items] tem cada objeto projeto
-        task_dict = task.get_data_for_api()
-        task_dict['DT_RowId'] = task.id
-        serialized_tasks.append(task_dict)
-    result = dict()
-    result['data'] = serialized_tasks
-    result['draw'] = tasks['draw']
-    result['recordsTotal'] = tasks['count']
-    result['recordsFiltered'] = tasks['count']
-    return JsonResponse(result, status=200)
+    return helper_datatables_response(TaskModel.query_products_by_args(request))
+
+
+def helper_datatables_response(query_result: dict) -> JsonResponse:
+    """Helper que monta a response do DataTables a partir do dict retornado pelo query_products_by_args das classes de
+    tarefa. query_result['items'] tem cada objeto da pagina"""
+    if not query_result['items']:
+        # buscas sem resultado sao comuns (cada tecla na busca do DataTables gera um draw), entao o corpo vazio eh
+        #  montado direto. Somente o draw passa pelo json, para sair com o mesmo tipo (e escape) da response normal
+        records_count = query_result['count']
+        return HttpResponse(DATATABLES_EMPTY_RESPONSE_CONTENT % (json.dumps(query_result['draw']), records_count,
+                                                                 records_count),
+                            content_type='application/json')
+    return JsonResponse({
+        'data': [{**item.get_data_for_api(), 'DT_RowId': item.id} for item in query_result['items']],
+        'draw': query_result['draw'],
+        'recordsTotal': query_result['count'],
+        'recordsFiltered': query_result['count'],
+    }, status=200, json_dumps_params=DATATABLES_JSON_DUMPS_PARAMS)
 
 
 def get_project_class_and_fields() -> Tuple[Type[Project], List[str]]:
@@ -768,6 +792,24 @@ def get_holder_class_and_fields() -> Tuple[Type[Holder], List[str]]:
     return Holder, ['id', 'name']
 
 
+# classe e campos do values_list de cada select2 dinamico, indexados pelo filtered_class enviado pelo javascript. O dict
+#  eh montado uma unica vez, e nao a cada request do api_filter_generic
+FILTER_GENERIC_CLASSES = {
+    'project': get_project_class_and_fields(),
+    'filter_project': get_project_class_and_fields(),
+    'project_model': get_project_model_class_and_fields(),
+    'task': get_task_class_and_fields(),
+    'task_model': get_task_model_class_and_fields(),
+    'holder': get_holder_class_and_fields(),
+    'main_holder': get_holder_class_and_fields(),
+    'product': get_product_class_and_fields(),
+}
+
+# classes do app de tarefas cujas buscas do select2 ficam em cache (a invalidacao eh feita pelos signals dos modelos)
+FILTER_GENERIC_CACHED_CLASSES = (Project, ProjectModel, Task, TaskModel)
+FILTER_GENERIC_CACHE_TIMEOUT = 60  # segundos que uma busca do select2 fica em cache
+
+
 @login_required
 @user_passes_test(lambda user: user.is_staff or user.user_user_profile.user_is_catalog)
 def api_filter_generic(request):
@@ -777,28 +819,36 @@ def api_filter_generic(request):
             no formulário, que geralmente coincide com o nome do atributo do modelo. Olhando de maneira mais alto nivel,
             o que o javascript passa neste parametro é o atributo name do elemento html.
         - search: valor a ser buscado. Os objetos sao filtrados a partir deste valor.
-    Quando quisermos adicionar outro select2 dinamico devemos adicionar a classe na cadeia de elifs abaixo e colocar o
+    Quando quisermos adicionar outro select2 dinamico devemos adicionar a classe em FILTER_GENERIC_CLASSES e colocar o
     atributo select2_dynamic no formulario (ou, caso seja um formset, colocar a classe custom_widget_select2 no widget).
 
     Response exigida pela api do select2:
         {results:[{"id":val,"text":option}]}
     """
     filtered_class = request.GET.get('filtered_class', None)
-    classes = {
-        'project': get_project_class_and_fields(),
-        'filter_project': get_project_class_and_fields(),
-        'project_model': get_project_model_class_and_fields(),
-        'task': get_task_class_and_fields(),
-        'task_model': get_task_model_class_and_fields(),
-        'holder': get_holder_class_and_fields(),
-        'main_holder': get_holder_class_and_fields(),
-        'product': get_product_class_and_fields(),
-    }
-    try:
-        class_to_filter, values_list_fields = classes[filtered_class]
+    invalid_class_message = 'The specified filtered class was not provided or is invalid.'
+    # o get evita levantar e tratar um KeyError a cada request com classe invalida (ou nao informada)
+    filtered_class_and_fields = FILTER_GENERIC_CLASSES.get(filtered_class)
+    if filtered_class_and_fields is None:
+        return HttpResponseBadRequest(invalid_class_message)
+    class_to_filter, values_list_fields = filtered_class_and_fields
+    if class_to_filter not in FILTER_GENERIC_CACHED_CLASSES:
         return default_api_get_queryset_for_select2(request, class_to_filter, values_list_fields)
-    except KeyError:
-        return HttpResponseBadRequest('The specified filtered class was not provided or is invalid.')
+
+    # A busca eh refeita a cada tecla digitada no select2, entao a response fica em cache por alguns segundos. O
+    #  resultado depende do usuario (os objetos sao filtrados pelo catalogo dele) e de todos os parametros da request
+    #  (ordenados, para que a ordem na url nao gere chaves diferentes), por isso ambos entram na chave. A versao da
+    #  classe eh incrementada pelos signals dos modelos, invalidando as buscas quando um objeto muda
+    cache_version = cache.get_or_set(get_select2_cache_version_key(class_to_filter), 1, None)
+    cache_key = 'tasks:select2:' + hashlib.md5(
+        f"{request.user.id}:{sorted(request.GET.lists())}".encode()).hexdigest()
+    cached_content = cache.get(cache_key, version=cache_version)
+    if cached_content is not None:
+        return HttpResponse(cached_content, content_type='application/json')
+    response = default_api_get_queryset_for_select2(request, class_to_filter, values_list_fields)
+    if response.status_code == 200:
+        cache.set(cache_key, response.content, FILTER_GENERIC_CACHE_TIMEOUT, version=cache_version)
+    return response
 
 
 @login_required
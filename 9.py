@@ -1,10 +1,12 @@
-from typing import List
+from functools import lru_cache
+from typing import Iterable, List
 
 from auditlog.registry import auditlog
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Q, Avg, F, QuerySet
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Q, Avg, F, QuerySet, Count, prefetch_related_objects
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
@@ -31,19 +33,54 @@ PROJECT_MODEL_ORDER_COLUMN_CHOICES = ['title', 'num_tasks']  # lista que corresp
 TASK_MODEL_ORDER_COLUMN_CHOICES = ['title','days_after_start','group','assigned_to',]  # lista que corresponde a ordem das colunas no datatables
 
 
+def get_select2_cache_version_key(filtered_class) -> str:
+    """Chave de cache com a versao das buscas em cache do select2 dinamico (api_filter_generic) da classe. A versao eh
+    incrementada sempre que um objeto da classe eh salvo ou removido, invalidando de uma vez todas as buscas da classe"""
+    return f'tasks:select2_version:{filtered_class._meta.model_name}'
+
+
 def default_task_objects_filter(filtered_class, searched_value: str, request_user: User,
                                 values_list_fields: list = None, custom_query: Q = Q()) -> QuerySet:
     """Centraliza os métodos de filtro das classes de tarefa, já que são similares. Vide docstring do método chamado."""
-    queryset = filtered_class.objects.all()
-
     search_fields = ['title']
     # Caso o usuario tenha passado uma query como parametro, o filtro sera feito com base nela apenas
-    if custom_query:
-        queryset = queryset.objects.filter(custom_query)
+    queryset = filtered_class.objects.filter(custom_query) if custom_query else filtered_class.objects.all()
     return ObjectFilterer.filter_objects(filtered_class, searched_value, request_user.user_user_profile, search_fields,
                                          queryset, values_list_fields)
 
 
+def default_query_tasks_objects_by_args(request, filtered_class, related_fields: List[str] = None) -> dict:
+    """
+    Mesmo que default_query_assets_by_args, mas ja materializa a pagina de objetos do DataTables e carrega as FKs lidas
+        pelo get_data_for_api de todos os objetos da pagina de uma vez (uma query por relacao), ao inves de uma query
+        por objeto
+    Args:
+        request: request da api
+        filtered_class: classe dos objetos buscados
+        related_fields: FKs lidas pelo get_data_for_api da classe
+
+    Returns: dict contendo a lista de objetos e outras informacoes relevantes ao DataTables
+    """
+    result = default_query_assets_by_args(request, filtered_class)
+    result['items'] = list(result['items'])
+    if related_fields:
+        prefetch_related_objects(result['items'], *related_fields)
+    return result
+
+
+def _ellipsize(text: str, max_length: int, cut_length: int) -> str:
+    """Mantem o texto se ele tiver ate [max_length] caracteres. Caso contrario, corta em [cut_length] caracteres e
+    termina com reticencias"""
+    return text if len(text) <= max_length else text[:cut_length] + '...'
+
+
+@lru_cache(maxsize=128)
+def get_progress_html(prog) -> str:
+    """Barra de progresso exibida no admin. So existem 101 porcentagens possiveis (mais o None de projetos sem
+    tarefas), entao o html de cada uma eh montado uma unica vez"""
+    return return_mark_safe("""{prog}% - <progress max="100" value="{prog}"></progress>""".format(prog=prog))
+
+
 class Project(BaseModel):
     """Project is the mother class for this taks app."""
     catalog = models.ForeignKey(verbose_name=_('Catalog'), to=BaseCatalog, on_delete=models.SET_NULL, null=True,
@@ -82,11 +119,13 @@ class Project(BaseModel):
         """
         # noinspection PyBroadException
         try:
-            self.start_date = self.start_date + timedelta(days=postpone_days)
-            for task in self.task_project.all():
-                task.due_date = task.due_date + timedelta(days=postpone_days)
-                task.save()
-            self.save()
+            postpone_delta = timedelta(days=postpone_days)
+            with transaction.atomic():
+                # As tarefas sao adiadas num unico UPDATE, sem buscar e salvar cada uma. O update() nao passa pelo
+                #  auto_now, por isso o updated_at eh atualizado explicitamente. Tarefas sem data continuam sem data.
+                self.task_project.update(due_date=F('due_date') + postpone_delta, updated_at=timezone.now())
+                self.start_date = self.start_date + postpone_delta
+                self.save()
             return None
         except Exception as e:
             return str(e)
@@ -105,38 +144,86 @@ class Project(BaseModel):
             Returns:
                 dict contendo a queryset de produtos e outras informacoes relevantes ao DataTables
         """
-        return default_query_assets_by_args(request, Project)
+        result = default_query_tasks_objects_by_args(request, Project)
+        # a quantidade de tarefas de todos os projetos da pagina vem de uma unica query agrupada
+        tasks_count_by_project = dict(
+            Task.objects.filter(project__in=result['items']).exclude(status=TASK_STATUS_CANCELED).values_list(
+                'project_id').annotate(Count('id')).order_by())
+        for project in result['items']:
+            project.num_tasks = tasks_count_by_project.get(project.id, 0)
+        return result
 
     def get_project_valid_tasks(self):
         """retorna um queryset com todas tarefas nao canceladas do projeto
         """
-        return self.task_project.exclude(status=Task.get_canceled_status_code())
+        return self.task_project.exclude(status=TASK_STATUS_CANCELED)
 
     def count_tasks(self):
-        return self.get_project_valid_tasks().count()
+        # num_tasks eh preenchido pelas listagens (ex.: query_products_by_args) para evitar uma query por projeto. Sem
+        #  ele, a contagem eh guardada no mesmo atributo, e as demais chamadas na instancia (ex.: tasks_progress e as
+        #  porcentagens de atraso) nao repetem o COUNT
+        if not hasattr(self, 'num_tasks'):
+            self.num_tasks = self.get_project_valid_tasks().count()
+        return self.num_tasks
 
     count_tasks.short_description = _("# of Tasks")
 
     def get_tasks_past_due_date(self):
         return self.get_project_valid_tasks().filter(Q(
-            Q(status=Task.get_done_status_code(), due_date__lt=F('done_date')) |
-            Q(~Q(status=Task.get_done_status_code()) & Q(due_date__lt=timezone.now()))
+            Q(status=TASK_STATUS_DONE, due_date__lt=F('done_date')) |
+            Q(~Q(status=TASK_STATUS_DONE) & Q(due_date__lt=timezone.now()))
         ))
 
     def count_past_due_tasks(self):
-        return self.get_tasks_past_due_date().count()
+        if not hasattr(self, 'num_past_due_tasks'):
+            self.num_past_due_tasks = self.get_tasks_past_due_date().count()
+        return self.num_past_due_tasks
 
     count_past_due_tasks.short_description = _("# of Past Due Tasks")
 
     def count_past_due_not_on_hold_tasks(self):
-        return self.get_tasks_past_due_date().filter(~Q(status=Task.get_onhold_status_code())).count()
+        if not hasattr(self, 'num_past_due_not_on_hold_tasks'):
+            self.num_past_due_not_on_hold_tasks = self.get_tasks_past_due_date().filter(
+                ~Q(status=TASK_STATUS_ON_HOLD)).count()
+        return self.num_past_due_not_on_hold_tasks
 
     def get_done_tasks(self):
-        return self.get_project_valid_tasks().filter(status=Task.get_done_status_code(), due_date__isnull=False,
+        return self.get_project_valid_tasks().filter(status=TASK_STATUS_DONE, due_date__isnull=False,
                                                      done_date__isnull=False)
 
     def count_done_tasks(self):
-        return self.get_done_tasks().count()
+        if not hasattr(self, 'num_done_tasks'):
+            self.num_done_tasks = self.get_done_tasks().count()
+        return self.num_done_tasks
+
+    @staticmethod
+    def with_task_counts(queryset: QuerySet = None) -> QuerySet:
+        """
+        Anota na queryset de projetos as quantidades de tarefas lidas por count_tasks, count_done_tasks,
+            count_past_due_tasks e count_past_due_not_on_hold_tasks, de forma que os metodos de progresso e atraso do
+            projeto leem as anotacoes ao inves de fazer um COUNT cada. Os filtros sao os mesmos de
+            get_project_valid_tasks, get_done_tasks e get_tasks_past_due_date
+        Args:
+            queryset: queryset de projetos (por padrao, todos os projetos)
+
+        Returns: Queryset anotada com num_tasks, num_done_tasks, num_past_due_tasks e num_past_due_not_on_hold_tasks
+        """
+        if queryset is None:
+            queryset = Project.objects.all()
+        valid_task = ~Q(task_project__status=TASK_STATUS_CANCELED)
+        past_due_task = valid_task & Q(
+            Q(task_project__status=TASK_STATUS_DONE, task_project__due_date__lt=F('task_project__done_date')) |
+            Q(~Q(task_project__status=TASK_STATUS_DONE) & Q(task_project__due_date__lt=timezone.now()))
+        )
+        return queryset.annotate(
+            num_tasks=Count('task_project', filter=valid_task),
+            num_done_tasks=Count('task_project', filter=valid_task & Q(
+                task_project__status=TASK_STATUS_DONE, task_project__due_date__isnull=False,
+                task_project__done_date__isnull=False)),
+            num_past_due_tasks=Count('task_project', filter=past_due_task),
+            num_past_due_not_on_hold_tasks=Count('task_project', filter=past_due_task & ~Q(
+                task_project__status=TASK_STATUS_ON_HOLD)),
+        )
 
     count_done_tasks.short_description = _("# of Done Tasks")
 
@@ -149,65 +236,56 @@ class Project(BaseModel):
     def tasks_past_due_percentage(self):
         """Calcula o percentual de tarefas atrasadas
         """
-        if self.count_tasks() > 0:
-            return round(100 * (self.count_past_due_tasks() / self.count_tasks()), None)
+        # a contagem eh o divisor da porcentagem, entao um exists() no guard seria uma query a mais, nao a menos
+        if num_tasks := self.count_tasks():
+            return round(100 * (self.count_past_due_tasks() / num_tasks), None)
         else:
             return 0
 
     def tasks_past_due_not_on_hold_percentage(self):
         """Calcula o percentual de tarefas atrasadas QUE NÃO ESTÃO em estado de "em espera"
         """
-        if self.count_tasks() > 0:
-            return round(100 * (self.count_past_due_not_on_hold_tasks() / self.count_tasks()), None)
+        if num_tasks := self.count_tasks():
+            return round(100 * (self.count_past_due_not_on_hold_tasks() / num_tasks), None)
         else:
             return 0
 
     tasks_past_due_percentage.short_description = _("% of Tasks Past Due")
 
+    @staticmethod
+    def get_average_delay_in_days(done_tasks: QuerySet) -> int:
+        """Calcula no proprio banco a media de dias entre o prazo e a conclusao das tarefas terminadas, sem trazer as
+        tarefas para o python. Retorna 0 caso nao haja tarefas.
+        """
+        average_delay = done_tasks.aggregate(average_delay=Avg(F('done_date') - F('due_date')))['average_delay']
+        if average_delay is None:
+            return 0
+        # A media pode ter fracao de dia, por isso o arredondamento eh feito sobre o total e nao sobre o .days
+        return round(average_delay.total_seconds() / timedelta(days=1).total_seconds())
+
     def tasks_past_due_date_average(self) -> int:
         """Calcula a média de dias de atraso do projeto.
         """
-        total_days: int = 0
-        total_tasks: int = 0
-        for task in self.get_done_tasks():
-            total_days += (task.done_date - task.due_date).days
-            total_tasks += 1
-        # str(self.get_tasks_past_due_date().filter(Q(due_date__isnull=False)).aggregate(
-        #     average_difference=Avg(F('due_date') - F('done_date')))['average_difference'].days) + " " + _('day(s)')
-        try:
-            return round(total_days / total_tasks)
-        except ZeroDivisionError:
-            return 0
+        return self.get_average_delay_in_days(self.get_done_tasks())
 
     tasks_past_due_date_average.short_description = _("Avg Days Past Due")
 
     def tasks_past_due_date_not_on_hold_average(self) -> int:
         """Calcula a média de dias de atraso do projeto sem levar em conta as tarefas em espera.
         """
-        total_days: int = 0
-        total_tasks: int = 0
-        for task in self.get_done_tasks().filter(~Q(status=Task.get_onhold_status_code())):
-            total_days += (task.done_date - task.due_date).days
-            total_tasks += 1
-        # return str(self.get_tasks_past_due_date().filter(
-        #     Q(due_date__isnull=False) & ~Q(status=Task.get_onhold_status_code())).aggregate(
-        #     average_difference=Avg(F('due_date') - F('done_date')))['average_difference'].days) + " " + _('day(s)')
-        try:
-            return round(total_days / total_tasks)
-        except ZeroDivisionError:
-            return 0
+        return self.get_average_delay_in_days(
+            self.get_done_tasks().filter(~Q(status=TASK_STATUS_ON_HOLD)))
 
     def tasks_progress(self):
-        if self.count_tasks() > 0:
-            return round(100 * (self.count_done_tasks() / self.count_tasks()), None)
+        if num_tasks := self.count_tasks():
+            return round(100 * (self.count_done_tasks() / num_tasks), None)
         else:
             return None
 
     tasks_progress.short_description = '% ' + str(_("of Completion"))
 
     def tasks_progress_for_humans_admin(self):
-        return return_mark_safe(
-            """{prog}% - <progress max="100" value="{prog}"></progress>""".format(prog=self.tasks_progress()))
+        return get_progress_html(self.tasks_progress())
 
     tasks_progress_for_humans_admin.short_description = '% ' + str(_("of Completion"))
 
@@ -255,7 +333,11 @@ class ProjectModel(BaseModel):
         return self.tasks.all()
 
     def count_tasks(self):
-        return self.tasks.count()
+        # num_tasks eh preenchido pelas listagens (ex.: query_products_by_args) para evitar uma query por modelo. Sem
+        #  ele, a contagem eh guardada no mesmo atributo
+        if not hasattr(self, 'num_tasks'):
+            self.num_tasks = self.tasks.count()
+        return self.num_tasks
 
     count_tasks.short_description = _("# of Tasks")
 
@@ -264,8 +346,8 @@ class ProjectModel(BaseModel):
 
         """
         description = str(prefix_description) + "<br>" + str(self.description)
-        project_title = title[:50] if len(title) < 48 else "".join([title[:47], '...'])
-        project_subtitle = self.title[:50] if len(self.title) < 43 else "".join([self.title[:42], '...'])
+        project_title = _ellipsize(title, 47, 47)
+        project_subtitle = _ellipsize(self.title, 42, 42)
         project = Project(title="{} ({})".format(project_title, project_subtitle), description=description,
                           start_date=start_date)
         project.save()
@@ -275,19 +357,25 @@ class ProjectModel(BaseModel):
     def deploy_tasks(self, project):
         """ Deploy tasks for a project
         """
-        for task in self.tasks.all():
-            due_date = project.start_date + timedelta(days=task.days_after_start)
-            Task.objects.create(project=project, due_date=due_date, task_model_id=task.id)
-
-            # O código abaixo é executado no save.
-            # new_task = Task.objects.create(project=project, title=task.title, description=task.description,
-            #                                due_date=due_date, priority=task.priority,
-            #                                group=task.group, assigned_to=task.assigned_to)
-            # for item in task.taskitemmodel_taskmodel.order_by('id').all():
-            #     TaskItem.objects.create(title=item.title, task_id=new_task.id)
-        #     todo criar as relações de parent
-        for task in project.task_project.all():
-            task.attach_parent_tasks()
+        # os checklists de todos os modelos vem numa unica query, e o save de cada tarefa os le do prefetch
+        task_models = list(self.tasks.prefetch_related('taskitemmodel_taskmodel'))
+        with transaction.atomic():
+            # Cada tarefa passa pelo save (copia dos campos e checklists do modelo) e pelo post_save (notificacao de
+            #  nova tarefa, auditlog e cache)
+            new_tasks = [Task.objects.create(project=project, task_model=task_model,
+                                             due_date=project.start_date + timedelta(days=task_model.days_after_start))
+                         for task_model in task_models]
+            # Os pre-requisitos entre os modelos viram pre-requisitos entre as tarefas criadas com um SELECT na
+            #  tabela do M2M dos modelos e um INSERT na do M2M das tarefas, sem um attach_parent_tasks por tarefa
+            task_id_by_task_model_id = {new_task.task_model_id: new_task.id for new_task in new_tasks}
+            model_parents = TaskModel.parent_task_model.through.objects.filter(
+                from_taskmodel_id__in=task_id_by_task_model_id).values_list('from_taskmodel_id', 'to_taskmodel_id')
+            parent_task_through = Task.parent_task.through
+            parent_task_through.objects.bulk_create(
+                [parent_task_through(from_task_id=task_id_by_task_model_id[task_model_id],
+                                     to_task_id=task_id_by_task_model_id[parent_task_model_id])
+                 for task_model_id, parent_task_model_id in model_parents
+                 if parent_task_model_id in task_id_by_task_model_id], ignore_conflicts=True)
         return project.id
 
     @staticmethod
@@ -324,7 +412,13 @@ class ProjectModel(BaseModel):
             Returns:
                 dict contendo a queryset de produtos e outras informacoes relevantes ao DataTables
         """
-        return default_query_assets_by_args(request, ProjectModel)
+        result = default_query_tasks_objects_by_args(request, ProjectModel, ['catalog'])
+        # a quantidade de tarefas de todos os modelos da pagina vem de uma unica query agrupada na tabela do M2M
+        tasks_count_by_project_model = dict(ProjectModel.tasks.through.objects.filter(
+            projectmodel__in=result['items']).values_list('projectmodel_id').annotate(Count('id')).order_by())
+        for project_model in result['items']:
+            project_model.num_tasks = tasks_count_by_project_model.get(project_model.id, 0)
+        return result
 
     def get_data_for_api(self):
         return {
@@ -335,14 +429,24 @@ class ProjectModel(BaseModel):
         }
 
 
+# codigos dos status, usados diretamente nos filtros deste modulo (os get_*_status_code da Task retornam os mesmos)
+TASK_STATUS_NEW = 'NEW'
+TASK_STATUS_ON_HOLD = 'HOL'
+TASK_STATUS_DONE = 'DON'
+TASK_STATUS_CANCELED = 'CAN'
+
 TASK_STATUSES = (
-    ('NEW', _('New')),
-    ('HOL', _('On Hold')),
+    (TASK_STATUS_NEW, _('New')),
+    (TASK_STATUS_ON_HOLD, _('On Hold')),
     # ('WOR', _('Working')),
-    ('DON', _('Done')),
-    ('CAN', _('Canceled')),
+    (TASK_STATUS_DONE, _('Done')),
+    (TASK_STATUS_CANCELED, _('Canceled')),
 )
 
+# status que nao sao finalizados (nem terminada nem cancelada)
+TASK_UNFINISHED_STATUSES = tuple(status[0] for status in TASK_STATUSES
+                                 if status[0] not in (TASK_STATUS_DONE, TASK_STATUS_CANCELED))
+
 TASK_PRIORITY = (
     ('9LOW', _('Low')),
     ('5MED', _('Medium')),
@@ -350,6 +454,11 @@ TASK_PRIORITY = (
     ('0FAT', _('Fatal')),
 )
 
+# textos dos choices indexados pelo codigo, para exibir status/prioridade sem instanciar a tarefa (e, nas instancias,
+#  sem passar pelo get_*_display do django)
+TASK_STATUSES_DISPLAY = dict(TASK_STATUSES)
+TASK_PRIORITY_DISPLAY = dict(TASK_PRIORITY)
+
 TASK_PRIORITY_FRONT_CLASS = {
     '9LOW': 'secondary',
     '5MED': 'info',
@@ -447,7 +556,7 @@ class TaskModel(BaseModel):
             'catalog_name': self.catalog.__str__() if self.catalog else 'N/A',
             'group_name': self.group.__str__() if self.group else 'N/A',
             'assigned_to_name': self.assigned_to.__str__() if self.assigned_to else 'N/A',
-            'get_priority_display': self.get_priority_display(),
+            'get_priority_display': TASK_PRIORITY_DISPLAY.get(self.priority, self.priority),
         }
 
     @staticmethod
@@ -459,7 +568,7 @@ class TaskModel(BaseModel):
             Returns:
                 dict contendo a queryset de produtos e outras informacoes relevantes ao DataTables
         """
-        return default_query_assets_by_args(request, TaskModel)
+        return default_query_tasks_objects_by_args(request, TaskModel, ['catalog', 'group', 'assigned_to'])
 
     @staticmethod
     def get_column_order_choices() -> List[str]:
@@ -499,11 +608,21 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
     def __init__(self, *args, **kwargs):
         """Init """
         super(Task, self).__init__(*args, **kwargs)
-        self.prev_status = self.status
+        # le o status direto do __dict__ para nao disparar uma query quando o campo foi adiado (only/defer)
+        self.prev_status = self.__dict__.get('status')
 
     class Meta:
         verbose_name = _('Task')
         verbose_name_plural = _('Tasks')
+        indexes = [
+            # atende a busca de tarefas atrasadas de notify_about_late_tasks
+            models.Index(fields=['due_date', 'status'], name='tasks_late_idx', condition=Q(archived=False)),
+            # atende as contagens e medias por projeto (get_project_valid_tasks, get_done_tasks e
+            #  get_tasks_past_due_date), que filtram por status e comparam due_date com done_date, sem ler a tabela
+            models.Index(fields=['project', 'status', 'due_date', 'done_date'], name='tasks_project_status_idx'),
+            # atende a contagem de tarefas em aberto do usuario (get_count_tasks_by_user)
+            models.Index(fields=['assigned_to', 'status'], name='tasks_assigned_status_idx'),
+        ]
 
     def __str__(self):
         """str method"""
@@ -519,13 +638,30 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
         Args:
             initial_queryparams: Q inicial que contém o filtro de quais usuários desejam receber a notificação
 
+        Returns: Queryset de User
+        """
+        return Task.get_relevant_notification_recipients_by_ids(self.group_id, self.assigned_to_id, initial_queryparams)
+
+    @staticmethod
+    def get_relevant_notification_recipients_by_ids(group_id: int, assigned_to_id: int,
+                                                    initial_queryparams: Q) -> QuerySet(User):
+        """
+        Mesmo que get_relevant_task_notification_recipients, mas a partir apenas dos ids do grupo e do usuário
+            atribuído, sem precisar carregar a tarefa, o grupo ou o usuário
+        Args:
+            group_id: id do grupo da tarefa (ou None)
+            assigned_to_id: id do usuário atribuído à tarefa (ou None)
+            initial_queryparams: Q inicial que contém o filtro de quais usuários desejam receber a notificação
+
         Returns: Queryset de User
         """
         queryparams = Q()
-        if self.group:
-            queryparams = queryparams | Q(id__in=[user.id for user in self.group.users.all()])
-        if self.assigned_to:
-            queryparams = queryparams | Q(id=self.assigned_to_id)
+        if group_id:
+            # subquery na tabela do M2M ao inves do JOIN com os grupos, que multiplicava as linhas de cada usuario
+            queryparams = queryparams | Q(id__in=TaskGroup.users.through.objects.filter(
+                taskgroup_id=group_id).values('user_id'))
+        if assigned_to_id:
+            queryparams = queryparams | Q(id=assigned_to_id)
 
         queryparams &= initial_queryparams
         return User.objects.filter(queryparams).distinct()
@@ -554,76 +690,87 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
         Testa inicialmente o status para determinar o done date
         """
         if not self.id and self.task_model:
-            model = self.task_model
-            task_title = self.title
-            task_subtitle = model.title
-            if len(task_title) + len(task_subtitle) >= 150:
-                task_title = self.title[:70] if len(self.title) <= 70 else ''.join([self.title[:67], '...'])
-                task_subtitle = model.title[:75] if len(model.title) < 74 else ''.join([model.title[:72], '...'])
-
-            if task_title != '':
-                # pode ser que seja gerado via projeto sem título
-                final_title = f'{task_title} ({task_subtitle})'
-            else:
-                final_title = task_subtitle
-            self.title = final_title
-            if model.description:
-                final_description = '{}: {} <br><br><br> ----------- <br>{}: {}'.format(_('Model description'),
-                                                                                        model.description,
-                                                                                        _('Individual description'),
-                                                                                        self.description)
-            else:
-                final_description = self.description
-
-            self.description = final_description
-            self.priority = model.priority
-            self.group = model.group
-            self.assigned_to = model.assigned_to
-            self.is_private = model.is_private
-            super().save()
-            for item in model.taskitemmodel_taskmodel.all():
+            self.fill_from_task_model()
+            super().save(**kwargs)
+            for item in self.task_model.taskitemmodel_taskmodel.all():
                 TaskItem.objects.create(title=item.title, task=self, assigned_to=item.assigned_to, group=item.group,
                                         order=item.order)
         else:
-            super().save()
+            super().save(**kwargs)
+
+    def fill_from_task_model(self):
+        """Preenche titulo, descricao, prioridade, grupo, usuario atribuido e privacidade da tarefa a partir da sua
+        Tarefa Modelo, conforme descrito no save. Nao salva a tarefa nem cria os checklists."""
+        model = self.task_model
+        task_title = self.title
+        task_subtitle = model.title
+        if len(task_title) + len(task_subtitle) >= 150:
+            task_title = _ellipsize(self.title, 70, 67)
+            task_subtitle = _ellipsize(model.title, 73, 72)
+
+        if task_title != '':
+            # pode ser que seja gerado via projeto sem título
+            final_title = f'{task_title} ({task_subtitle})'
+        else:
+            final_title = task_subtitle
+        self.title = final_title
+        if model.description:
+            final_description = '{}: {} <br><br><br> ----------- <br>{}: {}'.format(_('Model description'),
+                                                                                    model.description,
+                                                                                    _('Individual description'),
+                                                                                    self.description)
+        else:
+            final_description = self.description
+
+        self.description = final_description
+        self.priority = model.priority
+        self.group_id = model.group_id
+        self.assigned_to_id = model.assigned_to_id
+        self.is_private = model.is_private
 
     def attach_parent_tasks(self):
         """Anexa os pre-requisitos de acordo com os modelos."""
-        if self.task_model:
-            if model_parent_tasks_id := [*self.task_model.parent_task_model.values_list('id', flat=True)]:
-                if parent_tasks := Task.objects.filter(task_model_id__in=model_parent_tasks_id, project=self.project):
-                    # * para expandir porque add() não aceita lista, apenas args
-                    self.parent_task.add(*parent_tasks)
+        if self.task_model_id:
+            # Os pre-requisitos do modelo entram como subquery na busca das tarefas do projeto, e as relacoes sao
+            #  inseridas direto na tabela do M2M (ignorando as ja existentes), sem trazer os modelos para o python
+            parent_task_models = TaskModel.parent_task_model.through.objects.filter(
+                from_taskmodel_id=self.task_model_id).values('to_taskmodel_id')
+            parent_tasks_ids = Task.objects.filter(task_model_id__in=parent_task_models,
+                                                   project_id=self.project_id).values_list('id', flat=True)
+            parent_task_through = Task.parent_task.through
+            parent_task_through.objects.bulk_create(
+                [parent_task_through(from_task_id=self.id, to_task_id=parent_task_id)
+                 for parent_task_id in parent_tasks_ids], ignore_conflicts=True)
 
     def check_parent_is_done(self):
         """Checa se existe algum parent em aberto"""
-        for parent in self.parent_task.all():
-            if parent.status not in [self.get_done_status_code(), self.get_canceled_status_code()]:
-                # caso tenha tarefa nova ou em espera
-                return False
-        return True
+        # um unico EXISTS procura algum parent novo ou em espera, sem carregar os parents
+        return not self.parent_task.exclude(
+            status__in=[TASK_STATUS_DONE, TASK_STATUS_CANCELED]).exists()
 
     def mark_status_as_done(self):
         """Marca a tarefa como feita. Se retornar None é porque saiu certo, qualquer string representa erro."""
-        if self.get_items_done_count() != self.taskitem_task.all().count():
+        # ter algum item em aberto equivale a ter menos itens feitos do que itens, mas com um unico EXISTS
+        if self.taskitem_task.filter(done=False).exists():
             return _('Task has open items. Please close them before marking the task as done.')
         elif not self.check_parent_is_done():
             return _('Task has open parent tasks. Please close them before marking the task as done.')
         else:
-            self.status = self.get_done_status_code()
+            self.status = TASK_STATUS_DONE
             self.done_date = timezone.now()
-            self.save()
+            # somente as colunas alteradas pela mudanca de status entram no UPDATE
+            self.save(update_fields=['status', 'done_date', 'updated_at'])
             notification_code = SystemNotification.get_task_status_updated_code()
             recipients = self.get_relevant_task_notification_recipients(
                 Q(user_user_profile__profilesystemnotification__notification__code=notification_code))
             notify_users(notification_code, recipients, action_object=self,
                          url=reverse('dashboard:tasks.schedule', args=[self.id]),
-                         extra_info=self.get_status_display())
+                         extra_info=str(TASK_STATUSES_DISPLAY.get(self.status, self.status)))
             return None
 
     def mark_status_as_new(self):
         """Marca a tarefa como nova. Se retornar None é porque saiu certo, qualquer string representa erro."""
-        self.status = self.get_new_status_code()
+        self.status = TASK_STATUS_NEW
         if self.get_items_done_count() > 0:
             return _('Task has done items.')
         return None
@@ -631,17 +778,17 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
     def mark_status_as_canceled_or_onhold(self, is_canceled=False):
         """Marca a tarefa como cancelada ou em espera."""
         if is_canceled:
-            self.status = self.get_canceled_status_code()
+            self.status = TASK_STATUS_CANCELED
         else:
-            self.status = self.get_onhold_status_code()
+            self.status = TASK_STATUS_ON_HOLD
         self.done_date = None
-        self.save()
+        self.save(update_fields=['status', 'done_date', 'updated_at'])
         notification_code = SystemNotification.get_task_status_updated_code()
         recipients = self.get_relevant_task_notification_recipients(
             Q(user_user_profile__profilesystemnotification__notification__code=notification_code))
         notify_users(notification_code, recipients, action_object=self,
                      url=reverse('dashboard:tasks.schedule', args=[self.id]),
-                     extra_info=self.get_status_display())
+                     extra_info=str(TASK_STATUSES_DISPLAY.get(self.status, self.status)))
         return None
 
     @classmethod
@@ -654,10 +801,7 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
         from django.core.exceptions import ObjectDoesNotExist
         try:
             task = cls.objects.get(id=task_id)
-            if form['project']:
-                task.project_id = form['project']
-            else:
-                task.project_id = None
+            task.project_id = form['project'] or None
             task.title = form['title']
             task.description = form['description']
             task.due_date = form['due_date']
@@ -666,7 +810,9 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
             task.group_id = form['group']
             # task.archived=form['archived']
             task.assigned_to_id = form['assigned_to']
-            task.save()
+            # somente as colunas editadas pelo formulario entram no UPDATE
+            task.save(update_fields=['project', 'title', 'description', 'due_date', 'status', 'priority', 'group',
+                                     'assigned_to', 'updated_at'])
             return task
         except ObjectDoesNotExist:
             return None
@@ -674,31 +820,28 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
     @staticmethod
     def get_new_status_code() -> str:
         """Return the new status code. Built for reuse."""
-        return "NEW"
+        return TASK_STATUS_NEW
 
     @staticmethod
     def get_done_status_code() -> str:
         """Return the done status code. Built for reuse."""
-        return "DON"
+        return TASK_STATUS_DONE
 
     @staticmethod
     def get_onhold_status_code() -> str:
         """Return the on hold status code. Built for reuse."""
-        return "HOL"
+        return TASK_STATUS_ON_HOLD
 
     @staticmethod
     def get_canceled_status_code() -> str:
         """Return the CANCELED status code. Built for reuse."""
-        return "CAN"
+        return TASK_STATUS_CANCELED
 
     @staticmethod
-    def get_all_statuses_code_except_finished() -> list:
+    def get_all_statuses_code_except_finished() -> tuple:
         """Return all statuses codes except get_done_status_code(). Built for reuse"""
-        status_list = []
-        for status in TASK_STATUSES:
-            if status[0] != Task.get_done_status_code() and status[0] != Task.get_canceled_status_code():
-                status_list.append(status[0])
-        return status_list
+        # a tupla eh imutavel, entao eh devolvida direto, sem copia a cada chamada
+        return TASK_UNFINISHED_STATUSES
 
     @staticmethod
     def get_count_tasks_by_user(user):
@@ -707,10 +850,12 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
         :param user: User
         :return: Integer
         """
+        # os grupos do usuario entram como subquery (semi-join), sem o JOIN com os usuarios do grupo que multiplicava
+        #  as tarefas e obrigava o distinct antes do COUNT
+        user_groups = TaskGroup.users.through.objects.filter(user_id=user.id).values('taskgroup_id')
         return Task.objects.filter(
-            ~Q(status=Task.get_done_status_code()),
-            Q(group__users__id=user.id, assigned_to_id__isnull=True) | Q(
-                assigned_to__id=user.id)).distinct().count()
+            ~Q(status=TASK_STATUS_DONE),
+            Q(group_id__in=user_groups, assigned_to_id__isnull=True) | Q(assigned_to_id=user.id)).count()
 
     def project_title(self):
         # test = self.objects.filter(assigned_to_id__isnull=)
@@ -737,18 +882,49 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
         # return done_items
 
     def get_items_done_count_for_humans(self):
-        num_items = self.taskitem_task.count()
-        return "%s/%s" % (self.get_items_done_count(), num_items)
+        items_counts = self.taskitem_task.aggregate(num_items=Count('id'),
+                                                    num_done_items=Count('id', filter=Q(done=True)))
+        return "%s/%s" % (items_counts['num_done_items'], items_counts['num_items'])
 
     get_items_done_count_for_humans.short_description = _('Task Items')
 
+    @staticmethod
+    def annotate_sub_items_counts(queryset: QuerySet, user_to_check: User) -> QuerySet:
+        """
+        Anota na queryset de tarefas os contadores de itens (checklists) usados por get_list_data_from_values, para que
+            as apis de listagem nao precisem buscar os itens de cada tarefa
+        Args:
+            queryset: queryset de tarefas
+            user_to_check: usuario em relacao ao qual os itens atribuidos sao contados
+
+        Returns: Queryset anotada com sub_items_total, sub_items_todo e sub_items_assignee_total
+        """
+        user_to_check_groups = user_to_check.task_group_users.values('id')
+        is_assignee = Q(taskitem_task__assigned_to_id=user_to_check.id) | Q(
+            taskitem_task__group_id__in=user_to_check_groups)
+        # distinct porque os filtros das listas podem fazer JOIN com os itens, multiplicando as linhas
+        return queryset.annotate(
+            sub_items_total=Count('taskitem_task', distinct=True),
+            sub_items_todo=Count('taskitem_task', filter=is_assignee & Q(taskitem_task__done=False), distinct=True),
+            sub_items_assignee_total=Count('taskitem_task', filter=is_assignee, distinct=True),
+        )
+
     def get_data_for_api(self, include_sub_item, include_id=False, user_to_check=None,
                          include_project_data: bool = False, include_comments: bool = False,
-                         include_parent_tasks: bool = False):
-        """Get product data for api responses"""
+                         include_parent_tasks: bool = False, user_to_check_groups: Iterable[int] = None,
+                         include_sub_items_counts: bool = True):
+        """Get product data for api responses
+
+        user_to_check_groups: ids of user_to_check's task groups, when the caller already has them (saves one query)
+        include_sub_items_counts: when False (and include_sub_item is False too), the sub items are not queried at all
+            and the sub_items__* counters stay 0
+        """
         sub_items_dict = []
         user_to_check_id = user_to_check.id if user_to_check is not None else 0
-        user_to_check_groups = [item.id for item in user_to_check.task_group_users.only('id')]
+        # set para que o teste de pertencimento de cada sub item nao percorra a lista
+        if user_to_check_groups is None:
+            user_to_check_groups = user_to_check.task_group_users.values_list('id', flat=True)
+        user_to_check_groups = set(user_to_check_groups)
         data = {
             'sub_items': None,
             'sub_items__total': 0,
@@ -765,20 +941,30 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
             'is_private': False,
         }
 
-        sub_items = self.taskitem_task.all()
-
-        for sub_item in sub_items:
-            sub_item_dict = sub_item.get_data_for_api(user_to_check_id, True)
-            sub_items_dict.append(sub_item_dict)
-            data['sub_items__total'] += 1
-            data['sub_items__todo'] += 1 if (
-                    (sub_item_dict['assigned_to__id'] == user_to_check_id or sub_item_dict[
-                        'assigned_to__group__id'] in user_to_check_groups) and not sub_item_dict['done']) else 0
-            data['sub_items__assignee_total'] += 1 if (
-                    sub_item_dict['assigned_to__id'] == user_to_check_id or sub_item_dict[
-                'assigned_to__group__id'] in user_to_check_groups) else 0
         if include_sub_item:
+            # o get_data_for_api de cada sub item le o responsavel e o grupo, que vem no mesmo JOIN
+            for sub_item in self.taskitem_task.select_related('assigned_to', 'group'):
+                sub_item_dict = sub_item.get_data_for_api(user_to_check_id, True)
+                sub_items_dict.append(sub_item_dict)
+                data['sub_items__todo'] += 1 if (
+                        (sub_item_dict['assigned_to__id'] == user_to_check_id or sub_item_dict[
+                            'assigned_to__group__id'] in user_to_check_groups) and not sub_item_dict['done']) else 0
+                data['sub_items__assignee_total'] += 1 if (
+                        sub_item_dict['assigned_to__id'] == user_to_check_id or sub_item_dict[
+                    'assigned_to__group__id'] in user_to_check_groups) else 0
+            data['sub_items__total'] = len(sub_items_dict)
             data['sub_items'] = sub_items_dict
+        elif include_sub_items_counts:
+            # sem a lista de itens, os contadores sao feitos pelo banco numa unica query, sem carregar os itens
+            is_assignee = Q(assigned_to_id=user_to_check_id) | Q(group_id__in=user_to_check_groups)
+            sub_items_counts = self.taskitem_task.aggregate(
+                total=Count('id'),
+                todo=Count('id', filter=is_assignee & Q(done=False)),
+                assignee_total=Count('id', filter=is_assignee),
+            )
+            data['sub_items__total'] = sub_items_counts['total']
+            data['sub_items__todo'] = sub_items_counts['todo']
+            data['sub_items__assignee_total'] = sub_items_counts['assignee_total']
 
         if include_project_data:
             data['project__description'] = self.project.description if self.project is not None else 'N/A'
@@ -786,12 +972,12 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
             data['project__start_date'] = self.project.start_date if self.project is not None else 'N/A'
 
         if include_parent_tasks:
-            for parent in self.parent_task.all():
-                data['parent_tasks__total'] += 1
-                data['parent_tasks'].append({
-                    'title': parent.get_tilte_with_id(),
-                    'status': parent.get_status_display()
-                })
+            # somente os campos exibidos, sem instanciar as tarefas (mesmo formato de get_tilte_with_id)
+            data['parent_tasks'] = [{
+                'title': f"[{parent['id']}] - {parent['title']}",
+                'status': TASK_STATUSES_DISPLAY.get(parent['status'], parent['status'])
+            } for parent in self.parent_task.values('id', 'title', 'status')]
+            data['parent_tasks__total'] = len(data['parent_tasks'])
 
         group = self.group
         group_name = _('N/A')
@@ -811,22 +997,26 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
                 if group.id in user_to_check_groups:
                     data['assignment_type'] += 'G'
 
-        for comment in self.taskcomment_set.order_by('-created_at').prefetch_related('user').all():
+        # o autor vem no JOIN dos comentarios, e o gravatar de cada autor eh calculado uma unica vez
+        avatar_by_user_id = {}
+        for comment in self.taskcomment_set.order_by('-created_at').select_related('user'):
             comment_user = comment.user
+            if comment_user.id not in avatar_by_user_id:
+                avatar_by_user_id[comment_user.id] = Profile.get_gravatar(comment_user)
             data['comments'].append({
                 'comment': comment.comment,
                 'created_at': comment.created_at,
                 'user__name': comment_user.get_username(),
-                'user__avatar': Profile.get_gravatar(comment_user),
+                'user__avatar': avatar_by_user_id[comment_user.id],
             })
         data['admin_url'] = self.get_admin_url()
         data['title'] = self.get_tilte_with_id()
         data['description'] = self.description
         data['due_date'] = self.due_date if self.due_date else _('No Date')
         data['status'] = self.status
-        data['status_display'] = self.get_status_display()
+        data['status_display'] = TASK_STATUSES_DISPLAY.get(self.status, self.status)
         data['priority'] = self.priority
-        data['priority_display'] = self.get_priority_display()
+        data['priority_display'] = TASK_PRIORITY_DISPLAY.get(self.priority, self.priority)
         data['group__name'] = group_name
         data['archived'] = self.archived
         data['assigned_to__name'] = assignee_name
@@ -838,6 +1028,51 @@ class Task(BaseModel, GetAdminUrl, BaseApiDataClass):
 
         return data
 
+    @staticmethod
+    def get_list_values_fields() -> List[str]:
+        """Campos (e anotacoes de annotate_sub_items_counts) lidos por get_list_data_from_values"""
+        return ['id', 'title', 'description', 'due_date', 'status', 'priority', 'assigned_to_id',
+                'assigned_to__username', 'group_id', 'group__name', 'project__title', 'sub_items_total',
+                'sub_items_todo', 'sub_items_assignee_total']
+
+    @staticmethod
+    def get_list_data_from_values(task_values: dict, user_to_check_id: int, user_to_check_groups: List[int]) -> dict:
+        """
+        Versao enxuta de get_data_for_api para as apis de listagem (lista e calendario), montada a partir de uma linha de
+            .values(*Task.get_list_values_fields()) de uma queryset anotada por annotate_sub_items_counts, sem instanciar
+            a tarefa nem buscar itens e comentarios
+        Args:
+            task_values: dict de uma linha do values()
+            user_to_check_id: id do usuario em relacao ao qual o tipo de atribuicao eh calculado
+            user_to_check_groups: ids dos grupos de tarefa do usuario
+
+        Returns: dict com as mesmas chaves de get_data_for_api usadas pelas listagens
+        """
+        assignment_type = ''
+        if user_to_check_id == task_values['assigned_to_id']:
+            assignment_type = 'O'
+        elif task_values['sub_items_assignee_total']:
+            assignment_type = 'C'
+        elif task_values['group_id'] is not None and task_values['group_id'] in user_to_check_groups:
+            assignment_type = 'G'
+
+        return {
+            'id': task_values['id'],
+            'title': f"[{task_values['id']}] - {task_values['title']}",
+            'description': task_values['description'],
+            'due_date': task_values['due_date'] if task_values['due_date'] else _('No Date'),
+            'status': task_values['status'],
+            'status_display': TASK_STATUSES_DISPLAY.get(task_values['status'], task_values['status']),
+            'priority': task_values['priority'],
+            'priority_display': TASK_PRIORITY_DISPLAY.get(task_values['priority'], task_values['priority']),
+            'assignment_type': assignment_type,
+            'assigned_to__name': task_values['assigned_to__username'] or _('N/A'),
+            'group__name': task_values['group__name'] if task_values['group__name'] is not None else _('N/A'),
+            'project__title': task_values['project__title'] if task_values['project__title'] is not None else 'N/A',
+            'sub_items__total': task_values['sub_items_total'],
+            'sub_items__todo': task_values['sub_items_todo'],
+        }
+
     @staticmethod
     def get_priority_front_color(priority):
         try:
@@ -900,6 +1135,12 @@ class TaskItem(TaskItemBase, BaseApiDataClass):
 
     group = models.ForeignKey(verbose_name=_('Group'), to='TaskGroup', on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta(TaskItemBase.Meta):
+        indexes = [
+            # atende a checagem de itens em aberto (mark_status_as_done) e as contagens de itens feitos da tarefa
+            models.Index(fields=['task', 'done'], name='tasks_item_task_done_idx'),
+        ]
+
     def get_data_for_api(self, user_to_check_id: int = 0, include_id: bool = False):
         """Get Task Items"""
         data = {
@@ -988,6 +1229,10 @@ class TaskComment(BaseModel):
     class Meta:
         verbose_name = _('Task Comment')
         verbose_name_plural = _('Task Comments')
+        indexes = [
+            # atende a listagem dos comentarios da tarefa, dos mais recentes para os mais antigos (get_data_for_api)
+            models.Index(fields=['task', '-created_at'], name='tasks_comment_task_idx'),
+        ]
 
     def __str__(self):
         """str method"""
@@ -1006,20 +1251,22 @@ def task_comment_post_save(sender, instance: TaskComment, created, *args, **kwar
     # O último Q antes do filtro garante que só os usuários que desejam este tipo de notificação o recebam.
     #  Os anteriores filtram os usuários relevantes para receber a notificação. No fim das contas, quem a recebe são
     #  os usuários relevantes *que marcaram* que desejam ser notificados disto.
-    queryparams = Q()
-    if instance.task.group:
-        queryparams = queryparams | Q(id__in=[user.id for user in instance.task.group.users.all()])
-    if instance.task.taskcomment_set.count() > 1:
-        queryparams = queryparams | Q(task_comment_user__task_id=instance.task_id)
-    if instance.task.assigned_to:
-        queryparams = queryparams | Q(id=instance.task.assigned_to_id)
-    if instance.task.taskitem_task.count() > 0:
-        queryparams = queryparams | Q(task_item_user__task_id=instance.task_id)
+    #  Cada grupo de usuários relevantes eh uma subquery por id, entao a busca dos destinatários eh uma única query,
+    #  sem trazer os usuários do grupo para o python e sem COUNTs previos: sem outros comentários ou sem itens, as
+    #  subqueries de comentários e itens simplesmente não trazem ninguém além do autor, que eh excluído.
+    task = instance.task
+    queryparams = Q(id__in=TaskComment.objects.filter(task_id=task.id).values('user_id')) | Q(
+        id__in=TaskItem.objects.filter(task_id=task.id, assigned_to_id__isnull=False).values('assigned_to_id'))
+    if task.group_id:
+        queryparams = queryparams | Q(id__in=TaskGroup.users.through.objects.filter(
+            taskgroup_id=task.group_id).values('user_id'))
+    if task.assigned_to_id:
+        queryparams = queryparams | Q(id=task.assigned_to_id)
     queryparams = queryparams & Q(
         user_user_profile__profilesystemnotification__notification__code=notification_code)
     recipients = User.objects.filter(queryparams).distinct().exclude(id=instance.user_id)
-    notify_users(notification_code, recipients, author=instance.user, action_object=instance.task,
-                 url=reverse('dashboard:tasks.schedule', args=[instance.task.id]),
+    notify_users(notification_code, recipients, author=instance.user, action_object=task,
+                 url=reverse('dashboard:tasks.schedule', args=[task.id]),
                  extra_info=f'"{instance.user}": {instance.comment[:25]}...')
 
 
@@ -1034,6 +1281,20 @@ def project_post_save(sender, instance, created, *args, **kwargs):
         instance.model.deploy_tasks(instance)
 
 
+# noinspection PyUnusedLocal
+@receiver([post_save, post_delete], sender=Project)
+@receiver([post_save, post_delete], sender=ProjectModel)
+@receiver([post_save, post_delete], sender=Task)
+@receiver([post_save, post_delete], sender=TaskModel)
+def select2_cache_invalidate(sender, *args, **kwargs):
+    """Invalida as buscas do select2 dinamico em cache da classe alterada"""
+    try:
+        cache.incr(get_select2_cache_version_key(sender))
+    except ValueError:
+        # a versao ainda nao existe no cache, ou seja, nao ha buscas da classe em cache
+        pass
+
+
 auditlog.register(Project)
 auditlog.register(ProjectModel)
 auditlog.register(TaskModel)
@@ -395,12 +395,8 @@ class LabelProduct(BaseModel, GetAdminUrl):
                     'email_logo': email_logo,
                     'email_master_client_name': email_master_client_name,
                 }
-                email_recipients = []
-                for recipient in recipients:
-                    email_recipients.append(recipient.email)
-
-                    if recipient.email is not None and recipient.email != '':
-                        email_recipients.append(recipient.email)
+                # O set evita enfileirar o mesmo email mais de uma vez no post_office
+                email_recipients = list({recipient.email for recipient in recipients if recipient.email})
                 try:
                     mail.send(
                         email_recipients,
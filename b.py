@@ -2254,12 +2254,8 @@ def post_save_invoices(sender, instance: Invoice, using, **kwargs):
                 'email_logo': email_logo,
                 'email_master_client_name': email_master_client_name,
             }
-            email_recipients = []
-            for recipient in recipients:
-                email_recipients.append(recipient.email)
-
-                if recipient.email is not None and recipient.email != '':
-                    email_recipients.append(recipient.email)
+            # O set evita enfileirar o mesmo email mais de uma vez no post_office
+            email_recipients = list({recipient.email for recipient in recipients if recipient.email})
             try:
                 mail.send(
                     email_recipients,
@@ -0,0 +1,44 @@
+import os
+import re
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def get_previous_tasks_migration() -> str:
+    """Nome da ultima migration do app tasks anterior a esta, lido dos arquivos do proprio diretorio de migrations, para
+    que esta migration fique sempre na ponta da sequencia linear do app"""
+    this_migration = os.path.splitext(os.path.basename(__file__))[0]
+    migrations_dir = os.path.dirname(os.path.abspath(__file__))
+    return max(os.path.splitext(file_name)[0] for file_name in os.listdir(migrations_dir)
+               if re.match(r'^\d{4}_\w+\.py$', file_name) and os.path.splitext(file_name)[0] < this_migration)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', get_previous_tasks_migration()),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=Q(archived=False), fields=['due_date', 'status'], name='tasks_late_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['project', 'status', 'due_date', 'done_date'], name='tasks_project_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['assigned_to', 'status'], name='tasks_assigned_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskitem',
+            index=models.Index(fields=['task', 'done'], name='tasks_item_task_done_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskcomment',
+            index=models.Index(fields=['task', '-created_at'], name='tasks_comment_task_idx'),
+        ),
+    ]